@@ -1,49 +1,120 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from sqlalchemy.orm import Session, contains_eager, raiseload, with_expression
+from sqlalchemy import select, insert, exists, func, or_, false, tuple_, lambda_stmt
 
+from .cache import TTLCache
 from .db import get_db
-from .security import get_current_user, get_current_user_optional
+from .security import CurrentUser, get_current_user, get_current_user_optional
 from .models import (
-    User, Event, PhotoAlbum, Photo, PhotoComment,
+    Event, PhotoAlbum, Photo, PhotoComment,
     event_participants, event_organizers,
 )
 from .schemas import (
     AlbumCreate, AlbumPublic,
-    PhotoCreate, PhotoPublic,
+    PhotoCreate, PhotoBulkCreate, PhotoPublic,
     PhotoCommentCreate, PhotoCommentPublic,
 )
 
 router = APIRouter(prefix="/albums", tags=["albums"])
 
+# Lectures d'events publics : la réponse est la même pour tous les utilisateurs,
+# on la garde 30s en mémoire (invalidée à chaque ajout album/photo/commentaire).
+# Cache propre au processus (pas de Redis) : l'invalidation ne touche que le
+# worker qui traite l'écriture, les autres peuvent servir l'ancienne liste
+# jusqu'à 30s ("Cache-Control: no-cache" force la relecture).
+_public_cache = TTLCache(maxsize=1024, ttl=30)
+
 
 # ---------- Helpers (droits d'accès event) ----------
-def _is_event_member(db: Session, event_id: int, user_id: int) -> bool:
-    is_participant = db.execute(
-        select(event_participants.c.user_id).where(
-            event_participants.c.event_id == event_id,
+def _is_event_member(user_id: int | None):
+    """
+    Expression SQL "participant OU organisateur", corrélée à Event.id.
+    Toujours fausse pour un utilisateur anonyme.
+    """
+    if user_id is None:
+        return false()
+    return or_(
+        exists().where(
+            event_participants.c.event_id == Event.id,
             event_participants.c.user_id == user_id,
-        )
-    ).first() is not None
-
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
+        ),
+        exists().where(
+            event_organizers.c.event_id == Event.id,
             event_organizers.c.user_id == user_id,
-        )
-    ).first() is not None
+        ),
+    )
 
-    return is_participant or is_organizer
 
+def _photo_count():
+    # COUNT corrélé à PhotoAlbum.id (index photos.album_id) : albums + compteurs en une requête
+    return with_expression(
+        PhotoAlbum.photo_count,
+        select(func.count(Photo.id)).where(Photo.album_id == PhotoAlbum.id).scalar_subquery(),
+    )
+
+
+def _get_event_access(db: Session, event_id: int, current_user: CurrentUser | None):
+    """
+    Une seule requête : existence de l'event, is_public et appartenance du user.
+    Retourne None si l'event n'existe pas, sinon une ligne (is_public, is_member).
+    """
+    user_id = current_user.id if current_user is not None else None
+    return db.execute(
+        select(
+            Event.is_public,
+            _is_event_member(user_id).label("is_member"),
+        ).where(Event.id == event_id)
+    ).one_or_none()
+
+
+def _get_album(db: Session, album_id: int, current_user: CurrentUser | None, with_photo_count: bool = False):
+    """
+    Album + event (JOIN, album.event chargé) + appartenance du user, en une requête.
+    Retourne None si l'album n'existe pas, sinon (album, is_member).
+    """
+    user_id = current_user.id if current_user is not None else None
+    stmt = (
+        select(PhotoAlbum, _is_event_member(user_id).label("is_member"))
+        .outerjoin(PhotoAlbum.event)
+        .options(contains_eager(PhotoAlbum.event), raiseload("*"))
+        .where(PhotoAlbum.id == album_id)
+    )
+    if with_photo_count:
+        stmt = stmt.options(_photo_count())
+    return db.execute(stmt).one_or_none()
+
+
+def _get_photo(db: Session, photo_id: int, current_user: CurrentUser | None):
+    """
+    Photo -> album -> event (JOINs, relations chargées) + appartenance du user.
+    Retourne None si la photo n'existe pas, sinon (photo, is_member).
+    """
+    user_id = current_user.id if current_user is not None else None
+    return db.execute(
+        select(Photo, _is_event_member(user_id).label("is_member"))
+        .outerjoin(Photo.album)
+        .outerjoin(PhotoAlbum.event)
+        .options(contains_eager(Photo.album).contains_eager(PhotoAlbum.event), raiseload("*"))
+        .where(Photo.id == photo_id)
+    ).one_or_none()
+
+
+def _can_view_event(is_public: bool, is_member: bool) -> bool:
+    # event public -> visible à tous ; event privé -> seulement membres
+    return is_public or is_member
 
-def _can_view_event(db: Session, event: Event, current_user: User | None) -> bool:
-    # event public -> visible à tous
-    if event.is_public:
-        return True
-    # event privé -> seulement membres
-    if current_user is None:
-        return False
-    return _is_event_member(db, event.id, current_user.id)
+
+def _set_next_cursor(response: Response, items: list, limit: int) -> None:
+    # page pleine => il reste peut-être des éléments : curseur = id du dernier
+    if len(items) == limit:
+        response.headers["X-Next-Cursor"] = str(items[-1].id)
+
+
+def _read_cache(key, cache_control: str | None):
+    # "Cache-Control: no-cache" => on force la relecture en base
+    if cache_control is not None and "no-cache" in cache_control.lower():
+        return None
+    return _public_cache.get(key)
 
 
 # ---------- Albums ----------
@@ -51,14 +122,14 @@ def _can_view_event(db: Session, event: Event, current_user: User | None) -> boo
 def create_album(
     payload: AlbumCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == payload.event_id)).scalar_one_or_none()
-    if event is None:
+    access = _get_event_access(db, payload.event_id, current_user)
+    if access is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
     # seuls participants / organizers peuvent créer un album
-    if not _is_event_member(db, payload.event_id, current_user.id):
+    if not access.is_member:
         raise HTTPException(status_code=403, detail="Only event participants/organizers can create an album")
 
     album = PhotoAlbum(
@@ -68,7 +139,8 @@ def create_album(
     )
     db.add(album)
     db.commit()
-    db.refresh(album)
+    album.photo_count = 0
+    _public_cache.invalidate("albums", payload.event_id)
     return album
 
 
@@ -76,51 +148,84 @@ def create_album(
 def get_album(
     album_id: int,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
+    cache_control: str | None = Header(default=None),
 ):
-    album = db.execute(select(PhotoAlbum).where(PhotoAlbum.id == album_id)).scalar_one_or_none()
-    if album is None:
+    key = ("album", album_id)
+    cached = _read_cache(key, cache_control)
+    if cached is not None:
+        return cached
+
+    row = _get_album(db, album_id, current_user, with_photo_count=True)
+    if row is None:
         raise HTTPException(status_code=404, detail="Album not found")
+    album, is_member = row
 
-    event = db.execute(select(Event).where(Event.id == album.event_id)).scalar_one_or_none()
+    event = album.event
     if event is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    if not _can_view_event(db, event, current_user):
+    if not _can_view_event(event.is_public, is_member):
         raise HTTPException(status_code=403, detail="Not allowed to view this album")
 
-    return album
+    result = AlbumPublic.model_validate(album)
+    if event.is_public:
+        _public_cache.set(key, result)
+    return result
 
 
 @router.get("/by-event/{event_id}", response_model=list[AlbumPublic])
 def list_albums_by_event(
     event_id: int,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
     limit: int = 50,
     offset: int = 0,
+    after: int | None = None,
+    cache_control: str | None = Header(default=None),
 ):
     if limit < 1 or limit > 200:
         raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
     if offset < 0:
         raise HTTPException(status_code=400, detail="offset must be >= 0")
 
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+    key = ("albums", event_id, limit, offset, after)
+    cached = _read_cache(key, cache_control)
+    if cached is not None:
+        _set_next_cursor(response, cached, limit)
+        return cached
+
+    access = _get_event_access(db, event_id, current_user)
+    if access is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    if not _can_view_event(db, event, current_user):
+    if not _can_view_event(access.is_public, access.is_member):
         raise HTTPException(status_code=403, detail="Not allowed to view albums for this event")
 
-    albums = db.execute(
+    stmt = (
         select(PhotoAlbum)
+        .options(_photo_count(), raiseload("*"))
         .where(PhotoAlbum.event_id == event_id)
-        .order_by(PhotoAlbum.created_at.desc())
+        .order_by(PhotoAlbum.created_at.desc(), PhotoAlbum.id.desc())
         .limit(limit)
         .offset(offset)
-    ).scalars().all()
+    )
+    if after is not None:
+        # keyset (ordre décroissant) : albums plus anciens que l'album `after`, pris dans cet événement
+        after_at = db.scalar(
+            select(PhotoAlbum.created_at).where(PhotoAlbum.id == after, PhotoAlbum.event_id == event_id)
+        )
+        if after_at is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(tuple_(PhotoAlbum.created_at, PhotoAlbum.id) < tuple_(after_at, after))
+    albums = db.execute(stmt).scalars().all()
 
-    return albums
+    result = [AlbumPublic.model_validate(a) for a in albums]
+    if access.is_public:
+        _public_cache.set(key, result)
+    _set_next_cursor(response, result, limit)
+    return result
 
 
 # ---------- Photos ----------
@@ -129,66 +234,136 @@ def add_photo(
     album_id: int,
     payload: PhotoCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    album = db.execute(select(PhotoAlbum).where(PhotoAlbum.id == album_id)).scalar_one_or_none()
-    if album is None:
+    row = _get_album(db, album_id, current_user)
+    if row is None:
         raise HTTPException(status_code=404, detail="Album not found")
+    album, is_member = row
 
-    # retrouver l'event via l'album
-    event = db.execute(select(Event).where(Event.id == album.event_id)).scalar_one_or_none()
-    if event is None:
+    # l'event est chargé avec l'album (JOIN)
+    if album.event is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
     # seuls participants/organizers peuvent poster des photos
-    if not _is_event_member(db, event.id, current_user.id):
+    if not is_member:
         raise HTTPException(status_code=403, detail="Only event participants/organizers can post photos")
 
     photo = Photo(
         album_id=album_id,
         uploader_id=current_user.id,
-        url=str(payload.url),
+        url=payload.url,
         caption=payload.caption,
     )
     db.add(photo)
     db.commit()
-    db.refresh(photo)
+    _public_cache.invalidate("photos", album_id)
+    # photo_count de l'album a changé
+    _public_cache.pop(("album", album_id))
+    _public_cache.invalidate("albums", album.event_id)
     return photo
 
 
+@router.post("/{album_id}/photos/bulk", response_model=list[PhotoPublic], status_code=201)
+def add_photos_bulk(
+    album_id: int,
+    payload: PhotoBulkCreate,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    row = _get_album(db, album_id, current_user)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Album not found")
+    album, is_member = row
+
+    if album.event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Only event participants/organizers can post photos")
+
+    # un seul INSERT multi-lignes (executemany côté driver) au lieu d'un INSERT par photo
+    photos = db.scalars(
+        insert(Photo).returning(Photo),
+        [
+            {
+                "album_id": album_id,
+                "uploader_id": current_user.id,
+                "url": p.url,
+                "caption": p.caption,
+            }
+            for p in payload.photos
+        ],
+    ).all()
+    db.commit()
+    # l'ordre de RETURNING n'est pas garanti sur un INSERT multi-lignes
+    photos.sort(key=lambda p: p.id)
+    _public_cache.invalidate("photos", album_id)
+    # photo_count de l'album a changé
+    _public_cache.pop(("album", album_id))
+    _public_cache.invalidate("albums", album.event_id)
+    return photos
+
+
 @router.get("/{album_id}/photos", response_model=list[PhotoPublic])
 def list_photos(
     album_id: int,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
     limit: int = 50,
     offset: int = 0,
+    after: int | None = None,
+    cache_control: str | None = Header(default=None),
 ):
     if limit < 1 or limit > 200:
         raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
     if offset < 0:
         raise HTTPException(status_code=400, detail="offset must be >= 0")
 
-    album = db.execute(select(PhotoAlbum).where(PhotoAlbum.id == album_id)).scalar_one_or_none()
-    if album is None:
+    key = ("photos", album_id, limit, offset, after)
+    cached = _read_cache(key, cache_control)
+    if cached is not None:
+        _set_next_cursor(response, cached, limit)
+        return cached
+
+    row = _get_album(db, album_id, current_user)
+    if row is None:
         raise HTTPException(status_code=404, detail="Album not found")
+    album, is_member = row
 
-    event = db.execute(select(Event).where(Event.id == album.event_id)).scalar_one_or_none()
+    event = album.event
     if event is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    if not _can_view_event(db, event, current_user):
+    if not _can_view_event(event.is_public, is_member):
         raise HTTPException(status_code=403, detail="Not allowed to view photos for this album")
 
-    photos = db.execute(
-        select(Photo)
+    # lambda_stmt : le SQL compilé est mis en cache, seuls les paramètres changent
+    # colonnes seules (pas d'entités ORM) : lignes sérialisées directement en PhotoPublic
+    stmt = lambda_stmt(
+        lambda: select(
+            Photo.id, Photo.album_id, Photo.uploader_id, Photo.url, Photo.caption, Photo.created_at,
+        )
         .where(Photo.album_id == album_id)
-        .order_by(Photo.created_at.asc())
+        .order_by(Photo.created_at.asc(), Photo.id.asc())
         .limit(limit)
         .offset(offset)
-    ).scalars().all()
-
-    return photos
+    )
+    if after is not None:
+        # keyset : on reprend juste après la photo `after` (index album_id, created_at, id) ;
+        # le curseur doit appartenir à cet album
+        after_at = db.scalar(select(Photo.created_at).where(Photo.id == after, Photo.album_id == album_id))
+        if after_at is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt += lambda s: s.where(tuple_(Photo.created_at, Photo.id) > tuple_(after_at, after))
+    rows = db.execute(stmt).mappings().all()
+
+    result = [PhotoPublic.model_validate(r) for r in rows]
+    if event.is_public:
+        _public_cache.set(key, result)
+    _set_next_cursor(response, result, limit)
+    return result
 
 
 # ---------- Comments ----------
@@ -197,22 +372,22 @@ def add_comment(
     photo_id: int,
     payload: PhotoCommentCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    photo = db.execute(select(Photo).where(Photo.id == photo_id)).scalar_one_or_none()
-    if photo is None:
+    row = _get_photo(db, photo_id, current_user)
+    if row is None:
         raise HTTPException(status_code=404, detail="Photo not found")
+    photo, is_member = row
 
-    album = db.execute(select(PhotoAlbum).where(PhotoAlbum.id == photo.album_id)).scalar_one_or_none()
+    album = photo.album
     if album is None:
         raise HTTPException(status_code=404, detail="Album not found")
 
-    event = db.execute(select(Event).where(Event.id == album.event_id)).scalar_one_or_none()
-    if event is None:
+    if album.event is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
     # seuls participants/organizers peuvent commenter
-    if not _is_event_member(db, event.id, current_user.id):
+    if not is_member:
         raise HTTPException(status_code=403, detail="Only event participants/organizers can comment photos")
 
     comment = PhotoComment(
@@ -222,44 +397,69 @@ def add_comment(
     )
     db.add(comment)
     db.commit()
-    db.refresh(comment)
+    _public_cache.invalidate("comments", photo_id)
     return comment
 
 
 @router.get("/photos/{photo_id}/comments", response_model=list[PhotoCommentPublic])
 def list_comments(
     photo_id: int,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
     limit: int = 50,
     offset: int = 0,
+    after: int | None = None,
+    cache_control: str | None = Header(default=None),
 ):
     if limit < 1 or limit > 200:
         raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
     if offset < 0:
         raise HTTPException(status_code=400, detail="offset must be >= 0")
 
-    photo = db.execute(select(Photo).where(Photo.id == photo_id)).scalar_one_or_none()
-    if photo is None:
+    key = ("comments", photo_id, limit, offset, after)
+    cached = _read_cache(key, cache_control)
+    if cached is not None:
+        _set_next_cursor(response, cached, limit)
+        return cached
+
+    row = _get_photo(db, photo_id, current_user)
+    if row is None:
         raise HTTPException(status_code=404, detail="Photo not found")
+    photo, is_member = row
 
-    album = db.execute(select(PhotoAlbum).where(PhotoAlbum.id == photo.album_id)).scalar_one_or_none()
+    album = photo.album
     if album is None:
         raise HTTPException(status_code=404, detail="Album not found")
 
-    event = db.execute(select(Event).where(Event.id == album.event_id)).scalar_one_or_none()
+    event = album.event
     if event is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    if not _can_view_event(db, event, current_user):
+    if not _can_view_event(event.is_public, is_member):
         raise HTTPException(status_code=403, detail="Not allowed to view comments for this photo")
 
-    comments = db.execute(
-        select(PhotoComment)
+    stmt = (
+        select(
+            PhotoComment.id, PhotoComment.photo_id, PhotoComment.author_id,
+            PhotoComment.content, PhotoComment.created_at,
+        )
         .where(PhotoComment.photo_id == photo_id)
-        .order_by(PhotoComment.created_at.asc())
+        .order_by(PhotoComment.created_at.asc(), PhotoComment.id.asc())
         .limit(limit)
         .offset(offset)
-    ).scalars().all()
+    )
+    if after is not None:
+        after_at = db.scalar(
+            select(PhotoComment.created_at).where(PhotoComment.id == after, PhotoComment.photo_id == photo_id)
+        )
+        if after_at is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(tuple_(PhotoComment.created_at, PhotoComment.id) > tuple_(after_at, after))
+    rows = db.execute(stmt).mappings().all()
 
-    return comments
+    result = [PhotoCommentPublic.model_validate(r) for r in rows]
+    if event.is_public:
+        _public_cache.set(key, result)
+    _set_next_cursor(response, result, limit)
+    return result
@@ -1,20 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, exists
 
 from .db import get_db
 from .models import User
 from .schemas import UserCreate, UserPublic, LoginRequest, Token
 from .security import hash_password, verify_password, create_access_token
-from .security import get_current_user
+from .security import CurrentUser, get_current_user
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
 @router.post("/register", response_model=UserPublic, status_code=201)
 def register(payload: UserCreate, db: Session = Depends(get_db)):
-    # email unique
-    existing = db.execute(select(User).where(User.email == payload.email)).scalar_one_or_none()
+    # email unique (EXISTS : booléen, sans charger l'utilisateur)
+    existing = db.scalar(select(exists().where(User.email == payload.email)))
     if existing:
         raise HTTPException(status_code=409, detail="Email already registered")
 
@@ -25,7 +25,6 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
     )
     db.add(user)
     db.commit()
-    db.refresh(user)
     return user
 
 
@@ -35,10 +34,10 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
     if not user or not verify_password(payload.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
-    token = create_access_token(subject=str(user.id))
+    token = create_access_token(subject=str(user.id), email=user.email, full_name=user.full_name)
     return Token(access_token=token)
 
 
 @router.get("/me", response_model=UserPublic)
-def me(current_user: User = Depends(get_current_user)):
+def me(current_user: CurrentUser = Depends(get_current_user)):
     return current_user
\ No newline at end of file
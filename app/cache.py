@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Cache mémoire (propre à chaque processus) : les entrées expirent après
+    `ttl` secondes, les plus anciennes sont évincées au-delà de `maxsize` (LRU).
+    Thread-safe : les routes synchrones s'exécutent dans le threadpool.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, *prefix):
+        """Supprime toutes les clés (tuples) qui commencent par `prefix`."""
+        n = len(prefix)
+        with self._lock:
+            for key in [k for k in self._data if k[:n] == prefix]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Caches d'autorisation : l'invalidation (pop) ne touche que le worker qui traite
+# la modification, et une lecture concurrente peut remettre l'ancienne valeur
+# juste après. Un droit retiré reste donc visible jusqu'à AUTH_CACHE_TTL secondes
+# sur les autres workers : ces caches ne servent qu'aux lectures, les routes
+# d'écriture relisent le rôle en base.
+AUTH_CACHE_TTL = 5
+
+# Appartenance à un event (participant OU organisateur), clé (event_id, user_id).
+# Invalidée par les routes events qui modifient participants / organisateurs.
+event_member_cache = TTLCache(maxsize=100_000, ttl=AUTH_CACHE_TTL)
+
+# Rôle organisateur sur un event, clé (event_id, user_id) : vérifié par les
+# lectures de gestion (billetterie). Invalidée par les routes events qui
+# ajoutent / retirent un organisateur.
+event_organizer_cache = TTLCache(maxsize=100_000, ttl=AUTH_CACHE_TTL)
+
+# Visibilité d'un event (is_public), clé event_id. Aucune route ne modifie ni ne
+# supprime un event : rien à invalider, le TTL borne seulement la mémoire.
+event_public_cache = TTLCache(maxsize=100_000, ttl=300)
+
+# JWT déjà vérifiés, clé = token brut : évite HMAC + base64 + JSON à chaque
+# requête authentifiée. La valeur porte l'`exp` du token, revérifié à chaque hit.
+token_cache = TTLCache(maxsize=10_000, ttl=300)
+
+# Utilisateur courant des anciens tokens (sans claims d'identité), clé user_id :
+# évite la lecture de `users` à chaque requête. TTL court, aucune route ne
+# modifiant aujourd'hui email / nom.
+user_cache = TTLCache(maxsize=10_000, ttl=30)
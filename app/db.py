@@ -1,18 +1,86 @@
+import os
+
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+
+# Pool de connexions : les connexions restent ouvertes et sont réutilisées
+# d'une requête à l'autre (pas de coût de connexion par requête)
+POOL_SIZE = 20
+MAX_OVERFLOW = 20
+
+# Cache des requêtes compilées (SQL généré une fois par forme de requête, seuls
+# les paramètres changent). Le défaut (500) est vite saturé par les variantes
+# des routes (options de chargement, EXISTS corrélés, curseurs) : au-delà, les
+# entrées sont évincées et recompilées.
+QUERY_CACHE_SIZE = 1200
 
-DATABASE_URL = "sqlite:///./app.db"
+connect_args = {}
+if DATABASE_URL.startswith("sqlite"):
+    connect_args["check_same_thread"] = False  # nécessaire pour SQLite
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},  # nécessaire pour SQLite
-)
+if os.getenv("DB_NULLPOOL") == "1":
+    # derrière PgBouncer (mode transaction) : c'est PgBouncer qui gère le pool
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args=connect_args,
+        poolclass=NullPool,
+        query_cache_size=QUERY_CACHE_SIZE,
+    )
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args=connect_args,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=30,
+        pool_pre_ping=True,   # vérifie la connexion avant usage (coupures réseau, redémarrage DB)
+        pool_recycle=1800,    # évite les connexions fermées côté serveur après inactivité
+        pool_use_lifo=True,   # réutilise les connexions les plus récentes, les autres peuvent expirer
+        query_cache_size=QUERY_CACHE_SIZE,
+    )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False : les objets restent utilisables après commit,
+# sans SELECT supplémentaire (plus besoin de db.refresh() après un INSERT)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 Base = declarative_base()
 
 
+def dialect_insert(model):
+    """
+    INSERT propre au dialecte (SQLite ou PostgreSQL), pour disposer de
+    on_conflict_do_nothing / on_conflict_do_update (UPSERT en une requête).
+    """
+    if engine.dialect.name == "postgresql":
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+
+def is_unique_violation(exc: IntegrityError, model, name: str) -> bool:
+    """
+    True si l'IntegrityError vient de la contrainte d'unicité `name` de `model`
+    (et non d'un NOT NULL, d'une clé étrangère, ...).
+    """
+    diag = getattr(exc.orig, "diag", None)
+    if diag is not None:
+        # PostgreSQL (psycopg) : nom de la contrainte fourni par le serveur
+        return diag.constraint_name == name
+    # SQLite : "UNIQUE constraint failed: table.col1, table.col2"
+    constraint = next(c for c in model.__table__.constraints if c.name == name)
+    columns = ", ".join(f"{c.table.name}.{c.name}" for c in constraint.columns)
+    return str(exc.orig) == f"UNIQUE constraint failed: {columns}"
+
+
+# Dépendance synchrone : close() rend la connexion au pool (ROLLBACK de remise à
+# zéro, donc un aller-retour réseau) et ne doit pas tourner dans la boucle
+# d'événements. FastAPI exécute ce "finally" dans un thread hors de la limite du
+# threadpool : il n'attend pas un thread occupé par une route en attente de connexion.
 def get_db():
     db = SessionLocal()
     try:
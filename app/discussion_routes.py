@@ -1,47 +1,106 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy import select, insert, update, delete, exists, literal, or_, and_, tuple_, lambda_stmt, Integer
 
-from .db import get_db
-from .models import Discussion, Message, Group, Event, User, group_members, event_participants, event_organizers
+from .cache import event_member_cache
+from .db import get_db, dialect_insert
+from .models import Discussion, Message, Group, Event, group_members, group_admins, event_participants, event_organizers
 from .schemas import DiscussionCreate, DiscussionPublic, MessageCreate, MessagePublic
-from .security import get_current_user
+from .security import CurrentUser, get_current_user
 
 router = APIRouter(prefix="/discussions", tags=["discussions"])
 
 
 # ---------- Helpers (droits d'accès) ----------
-def _can_access_discussion(db: Session, discussion: Discussion, user: User) -> bool:
+def _is_event_member(db: Session, event_id: int, user_id: int, cached: bool = True) -> bool:
+    # résultat gardé quelques secondes en mémoire (rafales de lectures chat du même user) ;
+    # cached=False pour les écritures : droit relu en base
+    key = (event_id, user_id)
+    if cached:
+        hit = event_member_cache.get(key)
+        if hit is not None:
+            return hit
+
+    # participant OU organisateur, en une seule requête (2 EXISTS combinés)
+    # lambda_stmt : le SQL compilé est mis en cache, seuls les paramètres changent
+    stmt = lambda_stmt(
+        lambda: select(
+            or_(
+                exists().where(
+                    event_participants.c.event_id == event_id,
+                    event_participants.c.user_id == user_id,
+                ),
+                exists().where(
+                    event_organizers.c.event_id == event_id,
+                    event_organizers.c.user_id == user_id,
+                ),
+            )
+        )
+    )
+    is_member = bool(db.scalar(stmt))
+    event_member_cache.set(key, is_member)
+    return is_member
+
+
+def _get_discussion(db: Session, discussion_id: int) -> Discussion | None:
+    # raiseload("*") : aucun chargement paresseux implicite (messages, ...)
+    stmt = lambda_stmt(
+        lambda: select(Discussion)
+        .options(raiseload("*"))
+        .where(Discussion.id == discussion_id)
+    )
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def _get_or_create_discussion(db: Session, column: str, value: int) -> Discussion:
+    """
+    Renvoie la discussion du groupe / de l'event ; la crée si absente.
+    Cas courant (discussion déjà là) : simple SELECT, sans écriture ni commit.
+    Sinon UPSERT : pas de course entre deux créations concurrentes.
+    """
+    discussion = db.scalars(
+        select(Discussion)
+        .options(raiseload("*"))
+        .where(getattr(Discussion, column) == value)
+    ).one_or_none()
+    if discussion is not None:
+        return discussion
+
+    discussion = db.scalars(
+        dialect_insert(Discussion)
+        .values({column: value})
+        .on_conflict_do_update(index_elements=[column], set_={column: value})
+        .returning(Discussion),
+        execution_options={"populate_existing": True},
+    ).one()
+    db.commit()
+    return discussion
+
+
+def _set_next_cursor(response: Response, items: list, limit: int) -> None:
+    # page pleine => il reste peut-être des éléments : curseur = id du dernier
+    if len(items) == limit:
+        response.headers["X-Next-Cursor"] = str(items[-1].id)
+
+
+def _can_access_discussion(db: Session, discussion: Discussion, user: CurrentUser, cached: bool = True) -> bool:
     """
     Règles d'accès:
     - Discussion liée à un groupe: user doit être membre du groupe
     - Discussion liée à un event: user doit être participant ou organisateur de l'event
+      (cached=False pour les écritures : pas de lecture du cache d'appartenance)
     """
     if discussion.group_id is not None:
-        is_member = db.execute(
-            select(group_members.c.user_id).where(
+        is_member = db.scalar(
+            select(exists().where(
                 group_members.c.group_id == discussion.group_id,
                 group_members.c.user_id == user.id,
-            )
-        ).first() is not None
+            ))
+        )
         return is_member
 
     if discussion.event_id is not None:
-        is_participant = db.execute(
-            select(event_participants.c.user_id).where(
-                event_participants.c.event_id == discussion.event_id,
-                event_participants.c.user_id == user.id,
-            )
-        ).first() is not None
-
-        is_organizer = db.execute(
-            select(event_organizers.c.user_id).where(
-                event_organizers.c.event_id == discussion.event_id,
-                event_organizers.c.user_id == user.id,
-            )
-        ).first() is not None
-
-        return is_participant or is_organizer
+        return _is_event_member(db, discussion.event_id, user.id, cached)
 
     return False
 
@@ -51,75 +110,46 @@ def _can_access_discussion(db: Session, discussion: Discussion, user: User) -> b
 def create_discussion(
     payload: DiscussionCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     # Vérifier que le groupe/event existe
     if payload.group_id is not None:
-        group = db.execute(select(Group).where(Group.id == payload.group_id)).scalar_one_or_none()
+        group = db.get(Group, payload.group_id)
         if group is None:
             raise HTTPException(status_code=404, detail="Group not found")
 
         # l'utilisateur doit être membre du groupe pour créer la discussion
-        is_member = db.execute(
-            select(group_members.c.user_id).where(
+        is_member = db.scalar(
+            select(exists().where(
                 group_members.c.group_id == payload.group_id,
                 group_members.c.user_id == current_user.id,
-            )
-        ).first() is not None
+            ))
+        )
         if not is_member:
             raise HTTPException(status_code=403, detail="Only group members can create the discussion")
 
     if payload.event_id is not None:
-        event = db.execute(select(Event).where(Event.id == payload.event_id)).scalar_one_or_none()
+        event = db.get(Event, payload.event_id)
         if event is None:
             raise HTTPException(status_code=404, detail="Event not found")
 
         # l'utilisateur doit être participant ou organisateur
-        is_participant = db.execute(
-            select(event_participants.c.user_id).where(
-                event_participants.c.event_id == payload.event_id,
-                event_participants.c.user_id == current_user.id,
-            )
-        ).first() is not None
-
-        is_organizer = db.execute(
-            select(event_organizers.c.user_id).where(
-                event_organizers.c.event_id == payload.event_id,
-                event_organizers.c.user_id == current_user.id,
-            )
-        ).first() is not None
-
-        if not (is_participant or is_organizer):
+        if not _is_event_member(db, payload.event_id, current_user.id, cached=False):
             raise HTTPException(status_code=403, detail="Only event participants/organizers can create the discussion")
 
     # Option produit : 1 discussion par groupe / event (évite doublons)
-    existing = None
     if payload.group_id is not None:
-        existing = db.execute(
-            select(Discussion).where(Discussion.group_id == payload.group_id)
-        ).scalar_one_or_none()
-    if payload.event_id is not None:
-        existing = db.execute(
-            select(Discussion).where(Discussion.event_id == payload.event_id)
-        ).scalar_one_or_none()
-
-    if existing:
-        return existing
-
-    discussion = Discussion(group_id=payload.group_id, event_id=payload.event_id)
-    db.add(discussion)
-    db.commit()
-    db.refresh(discussion)
-    return discussion
+        return _get_or_create_discussion(db, "group_id", payload.group_id)
+    return _get_or_create_discussion(db, "event_id", payload.event_id)
 
 
 @router.get("/{discussion_id}", response_model=DiscussionPublic)
 def get_discussion(
     discussion_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    discussion = db.execute(select(Discussion).where(Discussion.id == discussion_id)).scalar_one_or_none()
+    discussion = _get_discussion(db, discussion_id)
     if discussion is None:
         raise HTTPException(status_code=404, detail="Discussion not found")
 
@@ -135,42 +165,50 @@ def post_message(
     discussion_id: int,
     payload: MessageCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    discussion = db.execute(
-        select(Discussion).where(Discussion.id == discussion_id)
-    ).scalar_one_or_none()
+    discussion = _get_discussion(db, discussion_id)
     if discussion is None:
         raise HTTPException(status_code=404, detail="Discussion not found")
 
-    if not _can_access_discussion(db, discussion, current_user):
+    if not _can_access_discussion(db, discussion, current_user, cached=False):
         raise HTTPException(status_code=403, detail="Not allowed to post in this discussion")
 
     parent_id = payload.parent_message_id
 
-    # Si c'est une réponse, vérifier que le parent existe et appartient à la même discussion
+    # INSERT ... SELECT ... RETURNING : la vérification du parent (existe et
+    # appartient à la même discussion) est faite par l'INSERT lui-même
+    values = select(
+        literal(discussion_id),
+        literal(current_user.id),
+        literal(payload.content),
+        literal(parent_id, Integer),
+    )
     if parent_id is not None:
-        parent_msg = db.execute(
-            select(Message).where(Message.id == parent_id)
-        ).scalar_one_or_none()
-        if parent_msg is None:
-            raise HTTPException(status_code=404, detail="Parent message not found")
-
-        if parent_msg.discussion_id != discussion_id:
-            raise HTTPException(
-                status_code=400,
-                detail="Parent message must belong to the same discussion",
+        values = values.where(
+            exists().where(
+                Message.id == parent_id,
+                Message.discussion_id == discussion_id,
             )
+        )
+
+    msg = db.scalars(
+        insert(Message)
+        .from_select(["discussion_id", "author_id", "content", "parent_message_id"], values)
+        .returning(Message)
+    ).one_or_none()
+
+    if msg is None:
+        # aucune ligne insérée => parent absent ou dans une autre discussion
+        parent_exists = db.scalar(select(exists().where(Message.id == parent_id)))
+        if not parent_exists:
+            raise HTTPException(status_code=404, detail="Parent message not found")
+        raise HTTPException(
+            status_code=400,
+            detail="Parent message must belong to the same discussion",
+        )
 
-    msg = Message(
-        discussion_id=discussion_id,
-        author_id=current_user.id,
-        content=payload.content,
-        parent_message_id=parent_id,  # NEW
-    )
-    db.add(msg)
     db.commit()
-    db.refresh(msg)
     return msg
 
 
@@ -178,31 +216,49 @@ def post_message(
 @router.get("/{discussion_id}/messages", response_model=list[MessagePublic])
 def list_messages(
     discussion_id: int,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     limit: int = 50,
     offset: int = 0,
+    after: int | None = None,
 ):
     if limit < 1 or limit > 200:
         raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
     if offset < 0:
         raise HTTPException(status_code=400, detail="offset must be >= 0")
 
-    discussion = db.execute(select(Discussion).where(Discussion.id == discussion_id)).scalar_one_or_none()
+    discussion = _get_discussion(db, discussion_id)
     if discussion is None:
         raise HTTPException(status_code=404, detail="Discussion not found")
 
     if not _can_access_discussion(db, discussion, current_user):
         raise HTTPException(status_code=403, detail="Not allowed to read messages in this discussion")
 
-    messages = db.execute(
-        select(Message)
+    # colonnes seules (pas d'entités ORM) : lignes sérialisées directement en MessagePublic
+    stmt = lambda_stmt(
+        lambda: select(
+            Message.id, Message.discussion_id, Message.author_id,
+            Message.parent_message_id, Message.content, Message.created_at,
+        )
         .where(Message.discussion_id == discussion_id)
-        .order_by(Message.created_at.asc())
+        .order_by(Message.created_at.asc(), Message.id.asc())
         .limit(limit)
         .offset(offset)
-    ).scalars().all()
+    )
+    if after is not None:
+        # keyset : on reprend juste après le message `after` (index discussion_id, created_at, id) ;
+        # le curseur doit appartenir à cette discussion
+        after_at = db.scalar(
+            select(Message.created_at).where(Message.id == after, Message.discussion_id == discussion_id)
+        )
+        if after_at is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt += lambda s: s.where(tuple_(Message.created_at, Message.id) > tuple_(after_at, after))
+    rows = db.execute(stmt).mappings().all()
+    messages = [MessagePublic.model_validate(r) for r in rows]
 
+    _set_next_cursor(response, messages, limit)
     return messages
 
 # Discussion d'un groupe
@@ -210,31 +266,24 @@ def list_messages(
 def get_discussion_by_group(
     group_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    group = db.execute(select(Group).where(Group.id == group_id)).scalar_one_or_none()
+    group = db.get(Group, group_id)
     if group is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
     # accès: membre du groupe
-    is_member = db.execute(
-        select(group_members.c.user_id).where(
+    is_member = db.scalar(
+        select(exists().where(
             group_members.c.group_id == group_id,
             group_members.c.user_id == current_user.id,
-        )
-    ).first() is not None
+        ))
+    )
     if not is_member:
         raise HTTPException(status_code=403, detail="Not allowed to access this group discussion")
 
-    discussion = db.execute(select(Discussion).where(Discussion.group_id == group_id)).scalar_one_or_none()
-    if discussion is None:
-        # Option produit: on crée automatiquement si absent
-        discussion = Discussion(group_id=group_id)
-        db.add(discussion)
-        db.commit()
-        db.refresh(discussion)
-
-    return discussion
+    # Option produit: on crée automatiquement si absent
+    return _get_or_create_discussion(db, "group_id", group_id)
 
 
 # Discussion d'un évnénement
@@ -242,38 +291,17 @@ def get_discussion_by_group(
 def get_discussion_by_event(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
+    event = db.get(Event, event_id)
     if event is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    # accès: participant OU organizer (comme d'hab)
-    is_participant = db.execute(
-        select(event_participants.c.user_id).where(
-            event_participants.c.event_id == event_id,
-            event_participants.c.user_id == current_user.id,
-        )
-    ).first() is not None
-
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-
-    if not (is_participant or is_organizer):
+    # accès: participant OU organizer (comme d'hab) ; sans cache : la route peut créer la discussion
+    if not _is_event_member(db, event_id, current_user.id, cached=False):
         raise HTTPException(status_code=403, detail="Not allowed to access this event discussion")
 
-    discussion = db.execute(select(Discussion).where(Discussion.event_id == event_id)).scalar_one_or_none()
-    if discussion is None:
-        discussion = Discussion(event_id=event_id)
-        db.add(discussion)
-        db.commit()
-        db.refresh(discussion)
-
-    return discussion
+    return _get_or_create_discussion(db, "event_id", event_id)
 
 
 # Supression message
@@ -282,61 +310,81 @@ def delete_message(
     discussion_id: int,
     message_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    # discussion existe ?
-    discussion = db.execute(select(Discussion).where(Discussion.id == discussion_id)).scalar_one_or_none()
-    if discussion is None:
-        raise HTTPException(status_code=404, detail="Discussion not found")
+    user_id = current_user.id
 
-    # accès au fil
-    if not _can_access_discussion(db, discussion, current_user):
-        raise HTTPException(status_code=403, detail="Not allowed to access this discussion")
+    # accès au fil : membre du groupe, ou participant/organisateur de l'event
+    is_organizer = exists().where(
+        event_organizers.c.event_id == Discussion.event_id,
+        event_organizers.c.user_id == user_id,
+    )
+    can_access = or_(
+        and_(
+            Discussion.group_id.is_not(None),
+            exists().where(
+                group_members.c.group_id == Discussion.group_id,
+                group_members.c.user_id == user_id,
+            ),
+        ),
+        and_(
+            Discussion.group_id.is_(None),
+            or_(
+                exists().where(
+                    event_participants.c.event_id == Discussion.event_id,
+                    event_participants.c.user_id == user_id,
+                ),
+                is_organizer,
+            ),
+        ),
+    )
+    # suppression : auteur, OU organisateur de l'event, OU admin du groupe
+    can_delete = or_(
+        Message.author_id == user_id,
+        is_organizer,
+        exists().where(
+            group_admins.c.group_id == Discussion.group_id,
+            group_admins.c.user_id == user_id,
+        ),
+    )
 
-    # message existe et appartient à cette discussion ?
-    msg = db.execute(
-        select(Message).where(
+    # un seul DELETE conditionnel : toutes les règles sont évaluées par la base
+    deleted_id = db.execute(
+        delete(Message)
+        .where(
             Message.id == message_id,
             Message.discussion_id == discussion_id,
+            exists().where(Discussion.id == discussion_id, can_access, can_delete),
         )
+        .returning(Message.id)
     ).scalar_one_or_none()
-    if msg is None:
-        raise HTTPException(status_code=404, detail="Message not found")
 
-    # 1) auteur => ok
-    if msg.author_id == current_user.id:
-        db.delete(msg)
+    if deleted_id is not None:
+        # les réponses perdent leur parent (comme le faisait db.delete côté ORM)
+        db.execute(
+            update(Message)
+            .where(Message.parent_message_id == deleted_id)
+            .values(parent_message_id=None)
+        )
         db.commit()
         return
 
-    # 2) si discussion liée à un event => organizer peut supprimer
-    if discussion.event_id is not None:
-        is_organizer = db.execute(
-            select(event_organizers.c.user_id).where(
-                event_organizers.c.event_id == discussion.event_id,
-                event_organizers.c.user_id == current_user.id,
-            )
-        ).first() is not None
-        if is_organizer:
-            db.delete(msg)
-            db.commit()
-            return
+    # rien supprimé : on détermine la bonne erreur (chemin d'échec uniquement)
+    discussion = _get_discussion(db, discussion_id)
+    if discussion is None:
+        raise HTTPException(status_code=404, detail="Discussion not found")
 
-    # 3) si discussion liée à un groupe => admin peut supprimer
-    if discussion.group_id is not None:
-        # IMPORTANT: adapte le nom si ta table s'appelle différemment (ex: group_admins)
-        from .models import group_admins  # import local pour éviter erreurs si non utilisé ailleurs
+    if not _can_access_discussion(db, discussion, current_user):
+        raise HTTPException(status_code=403, detail="Not allowed to access this discussion")
 
-        is_admin = db.execute(
-            select(group_admins.c.user_id).where(
-                group_admins.c.group_id == discussion.group_id,
-                group_admins.c.user_id == current_user.id,
-            )
-        ).first() is not None
-        if is_admin:
-            db.delete(msg)
-            db.commit()
-            return
+    msg_exists = db.scalar(
+        select(exists().where(
+            Message.id == message_id,
+            Message.discussion_id == discussion_id,
+        ))
+    )
+    if not msg_exists:
+        raise HTTPException(status_code=404, detail="Message not found")
 
     raise HTTPException(status_code=403, detail="Not allowed to delete this message")
 
@@ -346,10 +394,16 @@ def delete_message(
 def list_replies(
     discussion_id: int,
     message_id: int,
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
+    limit: int = 50,
+    after: int | None = None,
 ):
-    discussion = db.execute(select(Discussion).where(Discussion.id == discussion_id)).scalar_one_or_none()
+    if limit < 1 or limit > 200:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
+
+    discussion = _get_discussion(db, discussion_id)
     if discussion is None:
         raise HTTPException(status_code=404, detail="Discussion not found")
 
@@ -357,7 +411,9 @@ def list_replies(
         raise HTTPException(status_code=403, detail="Not allowed")
 
     parent = db.execute(
-        select(Message).where(
+        select(Message)
+        .options(raiseload("*"))
+        .where(
             Message.id == message_id,
             Message.discussion_id == discussion_id,
         )
@@ -365,13 +421,28 @@ def list_replies(
     if parent is None:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    replies = db.execute(
+    stmt = (
         select(Message)
+        .options(raiseload("*"))
         .where(
             Message.discussion_id == discussion_id,
             Message.parent_message_id == message_id,
         )
-        .order_by(Message.created_at.asc())
-    ).scalars().all()
+        .order_by(Message.created_at.asc(), Message.id.asc())
+        .limit(limit)
+    )
+    if after is not None:
+        after_at = db.scalar(
+            select(Message.created_at).where(
+                Message.id == after,
+                Message.discussion_id == discussion_id,
+                Message.parent_message_id == message_id,
+            )
+        )
+        if after_at is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        stmt = stmt.where(tuple_(Message.created_at, Message.id) > tuple_(after_at, after))
+    replies = db.execute(stmt).scalars().all()
 
+    _set_next_cursor(response, replies, limit)
     return replies
@@ -1,47 +1,68 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import select, or_
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy import select, exists, func, literal, or_, tuple_, lambda_stmt
 
-from .db import get_db
+from .cache import event_member_cache, event_organizer_cache
+from .db import get_db, dialect_insert
 from .models import Event, Group, User, event_participants, event_organizers, group_members, group_admins
 from .schemas import EventCreate, EventPublic
-from .security import get_current_user, get_current_user_optional
+from .security import CurrentUser, get_current_user, get_current_user_optional
 
 router = APIRouter(prefix="/events", tags=["events"])
 
 
+# ---------- Helpers (rôles, corrélés à Event.id) ----------
+def _is_organizer(user_id: int):
+    return exists().where(
+        event_organizers.c.event_id == Event.id,
+        event_organizers.c.user_id == user_id,
+    )
+
+
+def _is_participant(user_id: int):
+    return exists().where(
+        event_participants.c.event_id == Event.id,
+        event_participants.c.user_id == user_id,
+    )
+
+
+def _event_exists(db: Session, event_id: int) -> bool:
+    # lambda_stmt : le SQL compilé est mis en cache, seuls les paramètres changent
+    return bool(db.scalar(lambda_stmt(lambda: select(exists().where(Event.id == event_id)))))
+
+
 @router.post("", response_model=EventPublic, status_code=201)
 def create_event(
     payload: EventCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    # Si l'event est rattaché à un groupe : vérifier que le groupe existe
+    # Si l'event est rattaché à un groupe : groupe + rôles du créateur, en une requête
     if payload.group_id is not None:
-        group = db.execute(select(Group).where(Group.id == payload.group_id)).scalar_one_or_none()
-        if group is None:
+        ctx = db.execute(
+            select(
+                Group.allow_member_events,
+                exists().where(
+                    group_members.c.group_id == Group.id,
+                    group_members.c.user_id == current_user.id,
+                ).label("is_member"),
+                exists().where(
+                    group_admins.c.group_id == Group.id,
+                    group_admins.c.user_id == current_user.id,
+                ).label("is_admin"),
+            ).where(Group.id == payload.group_id)
+        ).one_or_none()
+        if ctx is None:
             raise HTTPException(status_code=404, detail="Group not found")
 
-    # doit être membre du groupe
-        is_member = db.execute(
-            select(group_members.c.user_id).where(
-                group_members.c.group_id == payload.group_id,
-                group_members.c.user_id == current_user.id,
-            )
-        ).first() is not None
-        if not is_member:
+        # doit être membre du groupe
+        if not ctx.is_member:
             raise HTTPException(status_code=403, detail="Only group members can create events for this group")
 
-    # si les membres ne peuvent pas créer d'event => admin only
-        if not group.allow_member_events:
-            is_admin = db.execute(
-                select(group_admins.c.user_id).where(
-                    group_admins.c.group_id == payload.group_id,
-                    group_admins.c.user_id == current_user.id,
-                )
-            ).first() is not None
-            if not is_admin:
-                raise HTTPException(status_code=403, detail="Only group admins can create events for this group")
+        # si les membres ne peuvent pas créer d'event => admin only
+        if not ctx.allow_member_events and not ctx.is_admin:
+            raise HTTPException(status_code=403, detail="Only group admins can create events for this group")
 
 
     event = Event(
@@ -65,6 +86,8 @@ def create_event(
         event_organizers.insert().values(event_id=event.id, user_id=current_user.id)
     )
     db.commit()
+    event_member_cache.pop((event.id, current_user.id))
+    event_organizer_cache.pop((event.id, current_user.id))
 
     db.refresh(event)
     return event
@@ -75,43 +98,49 @@ def create_event(
 def join_event(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    # évite doublon
-    exists = db.execute(
-        select(event_participants.c.user_id).where(
-            (event_participants.c.event_id == event_id)
-            & (event_participants.c.user_id == current_user.id)
+    # INSERT ... SELECT depuis events : rien n'est inséré si l'event n'existe pas,
+    # et ON CONFLICT rend l'appel idempotent (déjà participant) sans SELECT préalable
+    user_id = current_user.id
+    result = db.execute(
+        lambda_stmt(
+            lambda: dialect_insert(event_participants)
+            .from_select(
+                ["event_id", "user_id"],
+                select(Event.id, user_id).where(Event.id == event_id),
+            )
+            .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
         )
-    ).first()
+    )
 
-    if exists:
-        return  # déjà participant --> idempotent
+    if result.rowcount == 0:
+        # aucune ligne : event absent, ou déjà participant --> idempotent
+        event_exists = _event_exists(db, event_id)
+        if not event_exists:
+            raise HTTPException(status_code=404, detail="Event not found")
+        return
 
-    db.execute(
-        event_participants.insert().values(event_id=event_id, user_id=current_user.id)
-    )
     db.commit()
+    event_member_cache.pop((event_id, user_id))
     return
 
 
-@router.get("/{event_id}/participants", response_model=list[dict])
-def list_participants(event_id: int, db: Session = Depends(get_db)):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+@router.get("/{event_id}/participants", response_class=ORJSONResponse)
+def list_participants(event_id: int, db: Session = Depends(get_db)) -> ORJSONResponse:
+    event_exists = _event_exists(db, event_id)
+    if not event_exists:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    # on renvoie une liste simplifiée (id, email, full_name)
+    # on renvoie une liste simplifiée (id, email, full_name) : 3 colonnes, pas d'entités User
+    # forme fixe (3 colonnes) : sérialisée directement par orjson, sans validation Pydantic
     participants = db.execute(
-        select(User).join(event_participants, User.id == event_participants.c.user_id)
+        select(User.id, User.email, User.full_name)
+        .join(event_participants, User.id == event_participants.c.user_id)
         .where(event_participants.c.event_id == event_id)
-    ).scalars().all()
+    ).mappings()
 
-    return [{"id": u.id, "email": u.email, "full_name": u.full_name} for u in participants]
+    return ORJSONResponse([dict(u) for u in participants])
 
 
 @router.post("/{event_id}/organizers/{user_id}", status_code=204)
@@ -119,118 +148,104 @@ def add_organizer(
     event_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
+    # existence de l'event + rôles de l'acteur et de la cible, en une requête
+    ctx = db.execute(
+        select(
+            Event.id,
+            _is_organizer(current_user.id).label("actor_is_org"),
+            exists().where(User.id == user_id).label("target_exists"),
+            _is_participant(user_id).label("target_is_participant"),
+        ).where(Event.id == event_id)
+    ).one_or_none()
+
     # 1) event existe ?
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
     # 2) seul un organisateur peut ajouter un autre organisateur
-    is_org = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-    if not is_org:
+    if not ctx.actor_is_org:
         raise HTTPException(status_code=403, detail="Only organizers can add organizers")
 
     # 3) user cible existe ?
-    target = db.execute(select(User).where(User.id == user_id)).scalar_one_or_none()
-    if target is None:
+    if not ctx.target_exists:
         raise HTTPException(status_code=404, detail="User not found")
 
     # 4) règle métier: target doit être participant
-    is_participant = db.execute(
-        select(event_participants.c.user_id).where(
-            event_participants.c.event_id == event_id,
-            event_participants.c.user_id == user_id,
-        )
-    ).first() is not None
-    if not is_participant:
+    if not ctx.target_is_participant:
         raise HTTPException(status_code=400, detail="User must be a participant before becoming organizer")
 
-    # 5) éviter doublon
-    already = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == user_id,
-        )
-    ).first() is not None
-    if already:
-        return
-
-    db.execute(event_organizers.insert().values(event_id=event_id, user_id=user_id))
+    # 5) éviter doublon : ON CONFLICT sur la clé (event_id, user_id)
+    db.execute(
+        dialect_insert(event_organizers)
+        .values(event_id=event_id, user_id=user_id)
+        .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
+    )
     db.commit()
+    event_member_cache.pop((event_id, user_id))
+    event_organizer_cache.pop((event_id, user_id))
     return
 
 
 
-@router.get("/{event_id}/organizers", response_model=list[dict])
-def list_organizers(event_id: int, db: Session = Depends(get_db)):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+@router.get("/{event_id}/organizers", response_class=ORJSONResponse)
+def list_organizers(event_id: int, db: Session = Depends(get_db)) -> ORJSONResponse:
+    event_exists = _event_exists(db, event_id)
+    if not event_exists:
         raise HTTPException(status_code=404, detail="Event not found")
 
     organizers = db.execute(
-        select(User)
+        select(User.id, User.email, User.full_name)
         .join(event_organizers, User.id == event_organizers.c.user_id)
         .where(event_organizers.c.event_id == event_id)
-    ).scalars().all()
+    ).mappings()
 
-    return [{"id": u.id, "email": u.email, "full_name": u.full_name} for u in organizers]
+    return ORJSONResponse([dict(u) for u in organizers])
 
 
 @router.get("/{event_id}", response_model=EventPublic)
 def get_event(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    # 1) Event public -> accessible à tous
-    if event.is_public:
-        return event
-
-    # 2) Event privé -> il faut être connecté
+    # Autorisation évaluée par la base : event public OU organisateur OU participant
+    # OU membre du groupe rattaché. Le OR s'arrête au premier critère vrai (un event
+    # public ne déclenche aucun EXISTS) ; cas nominal = une seule requête.
+    # (lambda_stmt : SQL compilé mis en cache, une variante par cas anonyme / connecté)
     if current_user is None:
-        raise HTTPException(status_code=403, detail="Event is private")
-
-    # 3) Organisateur ?
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
+        stmt = lambda_stmt(
+            lambda: select(Event).where(Event.id == event_id, Event.is_public == True)  # noqa: E712
         )
-    ).first() is not None
-    if is_organizer:
-        return event
-
-    # 4) Participant ?
-    is_participant = db.execute(
-        select(event_participants.c.user_id).where(
-            event_participants.c.event_id == event_id,
-            event_participants.c.user_id == current_user.id,
+    else:
+        user_id = current_user.id
+        stmt = lambda_stmt(
+            lambda: select(Event).where(
+                Event.id == event_id,
+                or_(
+                    Event.is_public == True,  # noqa: E712
+                    _is_organizer(user_id),
+                    _is_participant(user_id),
+                    exists().where(
+                        group_members.c.group_id == Event.group_id,
+                        group_members.c.user_id == user_id,
+                    ),
+                ),
+            )
         )
-    ).first() is not None
-    if is_participant:
+
+    event = db.execute(stmt).scalar_one_or_none()
+    if event is not None:
         return event
 
-    # 5) Event lié à un groupe : membre du groupe ?
-    if event.group_id is not None:
-        is_group_member = db.execute(
-            select(group_members.c.user_id).where(
-                group_members.c.group_id == event.group_id,
-                group_members.c.user_id == current_user.id,
-            )
-        ).first() is not None
+    # aucune ligne : event inexistant (404) ou non autorisé (403)
+    event_exists = _event_exists(db, event_id)
+    if not event_exists:
+        raise HTTPException(status_code=404, detail="Event not found")
 
-        if is_group_member:
-            return event
+    if current_user is None:
+        raise HTTPException(status_code=403, detail="Event is private")
 
     raise HTTPException(status_code=403, detail="Not allowed to view this event")
 
@@ -240,38 +255,36 @@ def remove_organizer(
     event_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
+    # existence de l'event + rôles + nombre d'organisateurs, en une requête
+    ctx = db.execute(
+        select(
+            Event.id,
+            _is_organizer(current_user.id).label("actor_is_org"),
+            _is_organizer(user_id).label("target_is_org"),
+            select(func.count())
+            .select_from(event_organizers)
+            .where(event_organizers.c.event_id == Event.id)
+            .scalar_subquery()
+            .label("org_count"),
+        ).where(Event.id == event_id)
+    ).one_or_none()
+
     # 1) event existe ?
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
     # 2) seul un organisateur peut retirer un organisateur
-    is_org = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-    if not is_org:
+    if not ctx.actor_is_org:
         raise HTTPException(status_code=403, detail="Only organizers can remove organizers")
 
     # 3) vérifier que la cible est bien organisateur
-    target_is_org = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == user_id,
-        )
-    ).first() is not None
-    if not target_is_org:
+    if not ctx.target_is_org:
         return  # idempotent : rien à faire
 
     # 4) ne pas supprimer le dernier organisateur
-    org_count = db.execute(
-        select(event_organizers.c.user_id).where(event_organizers.c.event_id == event_id)
-    ).all()
-    if len(org_count) <= 1:
+    if ctx.org_count <= 1:
         raise HTTPException(status_code=400, detail="Event must have at least one organizer")
 
     # 5) suppression
@@ -282,6 +295,8 @@ def remove_organizer(
         )
     )
     db.commit()
+    event_member_cache.pop((event_id, user_id))
+    event_organizer_cache.pop((event_id, user_id))
     return
 
 
@@ -289,22 +304,21 @@ def remove_organizer(
 def leave_event(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
+    # existence de l'event + rôle organisateur, en une requête
+    ctx = db.execute(
+        select(Event.id, _is_organizer(current_user.id).label("is_org"))
+        .where(Event.id == event_id)
+    ).one_or_none()
+
     # event existe ?
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
     # si l'utilisateur est organisateur, on interdit de quitter en tant que participant
     # (sinon incohérent: organizer mais plus participant)
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-    if is_organizer:
+    if ctx.is_org:
         raise HTTPException(status_code=400, detail="Organizers cannot leave the event (remove organizer role first)")
 
     # suppression participation (idempotent: si pas présent, ça fait rien)
@@ -315,16 +329,18 @@ def leave_event(
         )
     )
     db.commit()
+    event_member_cache.pop((event_id, current_user.id))
     return
 
-from sqlalchemy import or_
 
 @router.get("", response_model=list[EventPublic])
 def list_events(
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
     limit: int = 20,
     offset: int = 0,
+    after: int | None = None,
 ):
     # sécuriser limit (évite qu'un client demande 1 million d'items)
     if limit < 1 or limit > 100:
@@ -332,38 +348,42 @@ def list_events(
     if offset < 0:
         raise HTTPException(status_code=400, detail="offset must be >= 0")
 
+    # id en second critère : ordre stable entre deux events à la même date
+    query = (
+        select(Event)
+        .options(raiseload("*"))
+        .order_by(Event.start_date.desc(), Event.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+
     # Cas 1 : non connecté -> uniquement events publics
     if current_user is None:
-        events = db.execute(
-            select(Event)
-            .where(Event.is_public == True)  # noqa: E712
-            .order_by(Event.start_date.desc())
-            .limit(limit)
-            .offset(offset)
-        ).scalars().all()
-        return events
-
+        visible = Event.is_public == True  # noqa: E712
     # Cas 2 : connecté -> publics + privés où je suis participant/organizer
-    # On récupère les ids des events où je suis participant
-    participant_ids = db.execute(
-        select(event_participants.c.event_id).where(event_participants.c.user_id == current_user.id)
-    ).scalars().all()
-
-    # ids des events où je suis organizer
-    organizer_ids = db.execute(
-        select(event_organizers.c.event_id).where(event_organizers.c.user_id == current_user.id)
-    ).scalars().all()
-
-    allowed_private_ids = set(participant_ids) | set(organizer_ids)
-
-    query = select(Event).where(
-        or_(
+    # (semi-jointures EXISTS évaluées par la base, sans rapatrier les ids en Python)
+    else:
+        visible = or_(
             Event.is_public == True,  # noqa: E712
-            Event.id.in_(allowed_private_ids) if allowed_private_ids else False,
+            _is_participant(current_user.id),
+            _is_organizer(current_user.id),
         )
-    ).order_by(Event.start_date.desc()).limit(limit).offset(offset)
+    query = query.where(visible)
+
+    if after is not None:
+        # keyset (ordre décroissant) : events qui suivent l'event `after`
+        # (index start_date, id : pas de lecture des pages précédentes, contrairement à offset) ;
+        # le curseur passe par le même filtre de visibilité (sinon fuite de la date d'un event privé)
+        after_date = db.scalar(select(Event.start_date).where(Event.id == after, visible))
+        if after_date is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(Event.start_date, Event.id) < tuple_(after_date, after))
 
     events = db.execute(query).scalars().all()
+
+    # page pleine => il reste peut-être des events : curseur = id du dernier
+    if len(events) == limit:
+        response.headers["X-Next-Cursor"] = str(events[-1].id)
     return events
 
 
@@ -371,45 +391,34 @@ def list_events(
 def invite_group_members(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+    # event (groupe rattaché) + rôle organisateur, en une requête
+    ctx = db.execute(
+        select(Event.group_id, _is_organizer(current_user.id).label("is_org"))
+        .where(Event.id == event_id)
+    ).one_or_none()
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    if event.group_id is None:
+    if ctx.group_id is None:
         raise HTTPException(status_code=400, detail="This event is not linked to a group")
 
     # autorisation: organizer de l'event (simple)
-    is_org = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-    if not is_org:
+    if not ctx.is_org:
         raise HTTPException(status_code=403, detail="Only organizers can invite group members")
 
-    # récupérer tous les membres du groupe
-    member_ids = db.execute(
-        select(group_members.c.user_id).where(group_members.c.group_id == event.group_id)
-    ).scalars().all()
-
-    if not member_ids:
-        return
-
-    # récupérer les participants déjà inscrits
-    existing_ids = set(db.execute(
-        select(event_participants.c.user_id).where(event_participants.c.event_id == event_id)
-    ).scalars().all())
-
-    to_add = [uid for uid in member_ids if uid not in existing_ids]
-    if not to_add:
-        return
-
+    # INSERT ... SELECT des membres du groupe : la base ignore ceux déjà
+    # participants (ON CONFLICT sur la clé (event_id, user_id)), rien ne transite en Python
     db.execute(
-        event_participants.insert(),
-        [{"event_id": event_id, "user_id": uid} for uid in to_add]
+        dialect_insert(event_participants)
+        .from_select(
+            ["event_id", "user_id"],
+            select(literal(event_id), group_members.c.user_id)
+            .where(group_members.c.group_id == ctx.group_id),
+        )
+        .on_conflict_do_nothing(index_elements=["event_id", "user_id"])
     )
     db.commit()
+    event_member_cache.invalidate(event_id)
     return
@@ -1,17 +1,61 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy import select, exists, func
 
 from .db import get_db
-from .models import Group, User
+from .models import Group, User, group_members, group_admins
 from .schemas import GroupCreate, GroupPublic, GroupUpdate, UserPublic
-from .security import get_current_user
+from .security import CurrentUser, get_current_user
 
 router = APIRouter(prefix="/groups", tags=["groups"])
 
 
-def require_group_admin(group: Group, user: User):
-    if user not in group.admins:
+def _load_group_ctx(
+    db: Session,
+    group_id: int,
+    actor_id: int,
+    target_id: int | None = None,
+    with_admin_count: bool = False,
+):
+    """
+    Une seule requête : le groupe, si l'acteur en est admin et, si target_id est
+    fourni, si la cible existe / est membre / est admin (+ nombre d'admins si demandé).
+    Retourne None si le groupe n'existe pas.
+    """
+    columns = [
+        Group,
+        exists().where(
+            group_admins.c.group_id == Group.id,
+            group_admins.c.user_id == actor_id,
+        ).label("is_admin"),
+    ]
+    if target_id is not None:
+        columns += [
+            exists().where(User.id == target_id).label("target_exists"),
+            exists().where(
+                group_members.c.group_id == Group.id,
+                group_members.c.user_id == target_id,
+            ).label("target_is_member"),
+            exists().where(
+                group_admins.c.group_id == Group.id,
+                group_admins.c.user_id == target_id,
+            ).label("target_is_admin"),
+        ]
+    if with_admin_count:
+        columns.append(
+            select(func.count())
+            .select_from(group_admins)
+            .where(group_admins.c.group_id == Group.id)
+            .scalar_subquery()
+            .label("admin_count")
+        )
+    return db.execute(
+        select(*columns).options(raiseload("*")).where(Group.id == group_id)
+    ).one_or_none()
+
+
+def require_group_admin(ctx):
+    if not ctx.is_admin:
         raise HTTPException(status_code=403, detail="Admin permissions required")
 
 
@@ -19,12 +63,13 @@ def require_group_admin(group: Group, user: User):
 def create_group(
     payload: GroupCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     group = Group(**payload.model_dump())
-    # créateur = admin + membre
-    group.members.append(current_user)
-    group.admins.append(current_user)
+    # créateur = admin + membre (instance ORM nécessaire pour les relations)
+    creator = db.get(User, current_user.id)
+    group.members.append(creator)
+    group.admins.append(creator)
 
     db.add(group)
     db.commit()
@@ -41,13 +86,16 @@ def list_groups(
     limit = min(max(limit, 1), 100)
     offset = max(offset, 0)
 
-    groups = db.execute(select(Group).offset(offset).limit(limit)).scalars().all()
+    # GroupPublic n'expose aucune relation : rien à charger en plus
+    groups = db.execute(
+        select(Group).options(raiseload("*")).offset(offset).limit(limit)
+    ).scalars().all()
     return groups
 
 
 @router.get("/{group_id}", response_model=GroupPublic)
 def get_group(group_id: int, db: Session = Depends(get_db)):
-    group = db.get(Group, group_id)
+    group = db.get(Group, group_id, options=[raiseload("*")])
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     return group
@@ -58,16 +106,18 @@ def update_group(
     group_id: int,
     payload: GroupUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    group = db.get(Group, group_id)
-    if not group:
+    ctx = _load_group_ctx(db, group_id, current_user.id)
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    require_group_admin(group, current_user)
+    require_group_admin(ctx)
 
-    for k, v in payload.model_dump(exclude_unset=True).items():
-        setattr(group, k, v)
+    group = ctx.Group
+    # champs envoyés par le client seulement, lus sur le modèle (sans model_dump)
+    for k in payload.model_fields_set:
+        setattr(group, k, getattr(payload, k))
 
     db.commit()
     db.refresh(group)
@@ -77,10 +127,16 @@ def update_group(
 # ----- Collections : members -----
 @router.get("/{group_id}/members", response_model=list[UserPublic])
 def list_members(group_id: int, db: Session = Depends(get_db)):
-    group = db.get(Group, group_id)
-    if not group:
+    group_exists = db.scalar(select(exists().where(Group.id == group_id)))
+    if not group_exists:
         raise HTTPException(status_code=404, detail="Group not found")
-    return group.members
+
+    # colonnes de UserPublic seulement (pas d'entités User ni de collection chargée)
+    return db.execute(
+        select(User.id, User.email, User.full_name)
+        .join(group_members, User.id == group_members.c.user_id)
+        .where(group_members.c.group_id == group_id)
+    ).mappings().all()
 
 
 @router.post("/{group_id}/members/{user_id}", status_code=204)
@@ -88,20 +144,20 @@ def add_member(
     group_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    group = db.get(Group, group_id)
-    if not group:
+    # groupe + droits de l'acteur + état de la cible, en une requête
+    ctx = _load_group_ctx(db, group_id, current_user.id, target_id=user_id)
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    require_group_admin(group, current_user)
+    require_group_admin(ctx)
 
-    user = db.get(User, user_id)
-    if not user:
+    if not ctx.target_exists:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if user not in group.members:
-        group.members.append(user)
+    if not ctx.target_is_member:
+        db.execute(group_members.insert().values(group_id=group_id, user_id=user_id))
         db.commit()
     return
 
@@ -111,24 +167,33 @@ def remove_member(
     group_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    group = db.get(Group, group_id)
-    if not group:
+    # groupe + droits de l'acteur + état de la cible, en une requête
+    ctx = _load_group_ctx(db, group_id, current_user.id, target_id=user_id)
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    require_group_admin(group, current_user)
+    require_group_admin(ctx)
 
-    user = db.get(User, user_id)
-    if not user:
+    if not ctx.target_exists:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if user in group.members:
-        group.members.remove(user)
+    # DELETE directs (idempotents : sans effet si la ligne n'existe pas)
+    db.execute(
+        group_members.delete().where(
+            group_members.c.group_id == group_id,
+            group_members.c.user_id == user_id,
+        )
+    )
 
     # si on retire un membre qui est admin, on le retire aussi des admins
-    if user in group.admins:
-        group.admins.remove(user)
+    db.execute(
+        group_admins.delete().where(
+            group_admins.c.group_id == group_id,
+            group_admins.c.user_id == user_id,
+        )
+    )
 
     db.commit()
     return
@@ -137,10 +202,16 @@ def remove_member(
 # ----- Collections : admins -----
 @router.get("/{group_id}/admins", response_model=list[UserPublic])
 def list_admins(group_id: int, db: Session = Depends(get_db)):
-    group = db.get(Group, group_id)
-    if not group:
+    group_exists = db.scalar(select(exists().where(Group.id == group_id)))
+    if not group_exists:
         raise HTTPException(status_code=404, detail="Group not found")
-    return group.admins
+
+    # colonnes de UserPublic seulement (pas d'entités User ni de collection chargée)
+    return db.execute(
+        select(User.id, User.email, User.full_name)
+        .join(group_admins, User.id == group_admins.c.user_id)
+        .where(group_admins.c.group_id == group_id)
+    ).mappings().all()
 
 
 @router.post("/{group_id}/admins/{user_id}", status_code=204)
@@ -148,23 +219,23 @@ def add_admin(
     group_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    group = db.get(Group, group_id)
-    if not group:
+    # groupe + droits de l'acteur + état de la cible, en une requête
+    ctx = _load_group_ctx(db, group_id, current_user.id, target_id=user_id)
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    require_group_admin(group, current_user)
+    require_group_admin(ctx)
 
-    user = db.get(User, user_id)
-    if not user:
+    if not ctx.target_exists:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if user not in group.members:
+    if not ctx.target_is_member:
         raise HTTPException(status_code=400, detail="User must be a member before becoming admin")
 
-    if user not in group.admins:
-        group.admins.append(user)
+    if not ctx.target_is_admin:
+        db.execute(group_admins.insert().values(group_id=group_id, user_id=user_id))
         db.commit()
     return
 
@@ -174,23 +245,28 @@ def remove_admin(
     group_id: int,
     user_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    group = db.get(Group, group_id)
-    if not group:
+    # groupe + droits de l'acteur + état de la cible, en une requête
+    ctx = _load_group_ctx(db, group_id, current_user.id, target_id=user_id, with_admin_count=True)
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    require_group_admin(group, current_user)
+    require_group_admin(ctx)
 
-    user = db.get(User, user_id)
-    if not user:
+    if not ctx.target_exists:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if user in group.admins:
+    if ctx.target_is_admin:
         # évite de laisser un groupe sans admin
-        if len(group.admins) == 1:
+        if ctx.admin_count == 1:
             raise HTTPException(status_code=400, detail="Group must have at least one admin")
-        group.admins.remove(user)
+        db.execute(
+            group_admins.delete().where(
+                group_admins.c.group_id == group_id,
+                group_admins.c.user_id == user_id,
+            )
+        )
         db.commit()
 
     return
@@ -0,0 +1,36 @@
+"""
+Création du schéma, lancée une fois au déploiement et non par les workers :
+    python -m app.init_db
+"""
+from sqlalchemy import inspect, text
+
+from .db import Base, engine
+from . import models  # noqa: F401  (enregistre les tables dans Base.metadata)
+
+
+def _add_ticket_sold_count() -> None:
+    """
+    Bases créées avant le compteur ticket_types.sold_count : ajoute la colonne
+    puis la remplit depuis les achats existants (sinon le stock repartirait de 0
+    et des billets déjà vendus pourraient être revendus).
+    """
+    columns = {c["name"] for c in inspect(engine).get_columns("ticket_types")}
+    if "sold_count" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE ticket_types ADD COLUMN sold_count INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text(
+            "UPDATE ticket_types SET sold_count = "
+            "(SELECT count(*) FROM ticket_purchases WHERE ticket_purchases.ticket_type_id = ticket_types.id)"
+        ))
+
+
+def init_db() -> None:
+    # crée les tables / index absents ; ne modifie pas une table existante
+    Base.metadata.create_all(bind=engine)
+    _add_ticket_sold_count()
+
+
+if __name__ == "__main__":
+    init_db()
+    print(f"Schema ready ({engine.url.render_as_string(hide_password=True)})")
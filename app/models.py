@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Table, Text, UniqueConstraint, Float 
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Table, Text, UniqueConstraint, Float, Index 
+from sqlalchemy.orm import relationship, query_expression
 from sqlalchemy.sql import func
 from .db import Base
 from datetime import datetime
@@ -16,13 +16,32 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    # récupère created_at (server_default) via INSERT ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
+
+    # relations inverses, déclarées des deux côtés (back_populates)
+    # lazy="raise" : tout accès non chargé explicitement (selectinload) lève une erreur
+    # au lieu de déclencher un N+1 silencieux
+    member_groups = relationship("Group", secondary="group_members", back_populates="members", lazy="raise")
+    admin_groups = relationship("Group", secondary="group_admins", back_populates="admins", lazy="raise")
+    organized_events = relationship("Event", secondary="event_organizers", back_populates="organizers", lazy="raise")
+    participating_events = relationship("Event", secondary="event_participants", back_populates="participants", lazy="raise")
+
+    shopping_items = relationship("ShoppingItem", back_populates="user")
+
 
 # Association tables
+# La clé primaire composite (group_id|event_id, user_id) est aussi l'index unique
+# qui couvre les tests d'appartenance (EXISTS ... WHERE event_id = ? AND user_id = ?) :
+# recherche directe dans l'index, sans lecture de la table.
+# L'index inverse (user_id, group_id|event_id) couvre les recherches par utilisateur
+# (ex. « mes événements », jointures depuis users) sans parcourir toute la table.
 group_members = Table(
     "group_members",
     Base.metadata,
     Column("group_id", ForeignKey("groups.id"), primary_key=True),
     Column("user_id", ForeignKey("users.id"), primary_key=True),
+    Index("ix_group_members_user", "user_id", "group_id"),
 )
 
 group_admins = Table(
@@ -30,6 +49,7 @@ group_admins = Table(
     Base.metadata,
     Column("group_id", ForeignKey("groups.id"), primary_key=True),
     Column("user_id", ForeignKey("users.id"), primary_key=True),
+    Index("ix_group_admins_user", "user_id", "group_id"),
 )
 
 event_participants = Table(
@@ -37,6 +57,7 @@ event_participants = Table(
     Base.metadata,
     Column("event_id", ForeignKey("events.id"), primary_key=True),
     Column("user_id", ForeignKey("users.id"), primary_key=True),
+    Index("ix_event_participants_user", "user_id", "event_id"),
 )
 
 event_organizers = Table(
@@ -44,6 +65,7 @@ event_organizers = Table(
     Base.metadata,
     Column("event_id", ForeignKey("events.id"), primary_key=True),
     Column("user_id", ForeignKey("users.id"), primary_key=True),
+    Index("ix_event_organizers_user", "user_id", "event_id"),
 )
 
 # Group
@@ -65,13 +87,20 @@ class Group(Base):
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
-    members = relationship("User", secondary=group_members, backref="member_groups")
-    admins = relationship("User", secondary=group_admins, backref="admin_groups")
+    __mapper_args__ = {"eager_defaults": True}
+
+    members = relationship("User", secondary=group_members, back_populates="member_groups", lazy="raise")
+    admins = relationship("User", secondary=group_admins, back_populates="admin_groups", lazy="raise")
 
 # Event
 class Event(Base):
     __tablename__ = "events"
 
+    __table_args__ = (
+        # liste des events : ORDER BY start_date DESC, id DESC (+ curseur sur ce couple)
+        Index("ix_events_start_date_id", "start_date", "id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
@@ -84,18 +113,28 @@ class Event(Base):
 
     group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
 
-    organizers = relationship("User", secondary=event_organizers, backref="organized_events")
-    participants = relationship("User", secondary=event_participants, backref="participating_events")
+    organizers = relationship("User", secondary=event_organizers, back_populates="organized_events", lazy="raise")
+    participants = relationship("User", secondary=event_participants, back_populates="participating_events", lazy="raise")
 
     shopping_list_enabled = Column(Boolean, nullable=False, default=False)
     carpool_enabled = Column(Boolean, nullable=False, default=False)  # pour plus tard
 
+    ticket_types = relationship("TicketType", back_populates="event")
+    ticket_purchases = relationship("TicketPurchase", back_populates="event")
+    shopping_items = relationship("ShoppingItem", back_populates="event")
+
 
 
 # Discussion
 class Discussion(Base):
     __tablename__ = "discussions"
 
+    __table_args__ = (
+        # 1 discussion max par groupe / par event (les NULL ne sont pas comparés)
+        UniqueConstraint("group_id", name="uq_discussion_group"),
+        UniqueConstraint("event_id", name="uq_discussion_event"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
 
     # lien exclusif : groupe OU event
@@ -111,6 +150,11 @@ class Discussion(Base):
 class Message(Base):
     __tablename__ = "messages"
 
+    __table_args__ = (
+        # pagination par curseur : WHERE discussion_id = ? ORDER BY created_at, id
+        Index("ix_messages_discussion_created", "discussion_id", "created_at", "id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
 
     discussion_id = Column(Integer, ForeignKey("discussions.id"), nullable=False)
@@ -125,8 +169,10 @@ class Message(Base):
     discussion = relationship("Discussion", back_populates="messages")
     author = relationship("User")
 
-    # self-referential relationships
-    parent = relationship("Message", remote_side=[id], backref="replies")
+    # self-referential relationships (déclarées des deux côtés, chargement paresseux
+    # explicite : les routes passent par des requêtes dédiées, pas par ces attributs)
+    parent = relationship("Message", remote_side=[id], back_populates="replies", lazy="select")
+    replies = relationship("Message", back_populates="parent", lazy="select")
 
 
 
@@ -134,6 +180,10 @@ class Message(Base):
 class PhotoAlbum(Base):
     __tablename__ = "photo_albums"
 
+    __table_args__ = (
+        Index("ix_photo_albums_event_created", "event_id", "created_at", "id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     event_id = Column(Integer, ForeignKey("events.id"), nullable=False)
 
@@ -144,11 +194,18 @@ class PhotoAlbum(Base):
     event = relationship("Event")
     photos = relationship("Photo", back_populates="album", cascade="all, delete-orphan")
 
+    # nombre de photos : calculé à la demande dans la requête (with_expression)
+    photo_count = query_expression()
+
 
 # Photo
 class Photo(Base):
     __tablename__ = "photos"
 
+    __table_args__ = (
+        Index("ix_photos_album_created", "album_id", "created_at", "id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     album_id = Column(Integer, ForeignKey("photo_albums.id"), nullable=False)
     uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -166,6 +223,10 @@ class Photo(Base):
 class PhotoComment(Base):
     __tablename__ = "photo_comments"
 
+    __table_args__ = (
+        Index("ix_photo_comments_photo_created", "photo_id", "created_at", "id"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     photo_id = Column(Integer, ForeignKey("photos.id"), nullable=False)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -181,6 +242,11 @@ class PhotoComment(Base):
 class Poll(Base):
     __tablename__ = "polls"
 
+    __table_args__ = (
+        # sondages d'un event : WHERE event_id = ? ORDER BY created_at DESC
+        Index("ix_polls_event_created", "event_id", "created_at"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     event_id = Column(Integer, ForeignKey("events.id"), nullable=False)
     creator_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -190,19 +256,21 @@ class Poll(Base):
 
     event = relationship("Event")
     creator = relationship("User")
-    questions = relationship("PollQuestion", back_populates="poll", cascade="all, delete-orphan")
+    # lazy="select" explicite : chargées par selectinload dans les routes
+    questions = relationship("PollQuestion", back_populates="poll", cascade="all, delete-orphan", lazy="select")
 
 # Question de sondage
 class PollQuestion(Base):
     __tablename__ = "poll_questions"
 
     id = Column(Integer, primary_key=True, index=True)
-    poll_id = Column(Integer, ForeignKey("polls.id"), nullable=False)
+    # index : questions d'un sondage (selectinload, résultats)
+    poll_id = Column(Integer, ForeignKey("polls.id"), nullable=False, index=True)
 
     question = Column(Text, nullable=False)
 
-    poll = relationship("Poll", back_populates="questions")
-    options = relationship("PollOption", back_populates="question", cascade="all, delete-orphan")
+    poll = relationship("Poll", back_populates="questions", lazy="select")
+    options = relationship("PollOption", back_populates="question", cascade="all, delete-orphan", lazy="select")
 
 
 # Réponses possibles 
@@ -210,11 +278,12 @@ class PollOption(Base):
     __tablename__ = "poll_options"
 
     id = Column(Integer, primary_key=True, index=True)
-    question_id = Column(Integer, ForeignKey("poll_questions.id"), nullable=False)
+    # index : options d'une question (selectinload, jointure des résultats)
+    question_id = Column(Integer, ForeignKey("poll_questions.id"), nullable=False, index=True)
 
     label = Column(String(255), nullable=False)
 
-    question = relationship("PollQuestion", back_populates="options")
+    question = relationship("PollQuestion", back_populates="options", lazy="select")
 
 
 # Vote d'un participant
@@ -223,7 +292,9 @@ class PollVote(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     question_id = Column(Integer, ForeignKey("poll_questions.id"), nullable=False)
-    option_id = Column(Integer, ForeignKey("poll_options.id"), nullable=False)
+    # index : comptage des votes par option (LEFT JOIN de poll_results) ;
+    # question_id est déjà couvert par la contrainte unique (question_id, user_id)
+    option_id = Column(Integer, ForeignKey("poll_options.id"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -248,10 +319,14 @@ class TicketType(Base):
     name = Column(String(100), nullable=False)
     amount = Column(Float, nullable=False, default=0.0)  # prix
     quantity_limit = Column(Integer, nullable=False)     # stock dispo
+    # billets vendus (compteur dénormalisé) : réservé par un UPDATE conditionnel
+    # atomique à l'achat, au lieu d'un COUNT(*) sur ticket_purchases
+    sold_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-    event = relationship("Event", backref="ticket_types")
+    event = relationship("Event", back_populates="ticket_types")
+    purchases = relationship("TicketPurchase", back_populates="ticket_type")
 
 
 class TicketPurchase(Base):
@@ -267,14 +342,18 @@ class TicketPurchase(Base):
     last_name = Column(String(100), nullable=False)
     address = Column(Text, nullable=False)
 
-    purchased_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # horodatage fourni par la base, relu par l'INSERT ... RETURNING de l'achat.
+    # default=func.now() : l'INSERT envoie explicitement CURRENT_TIMESTAMP (évalué par
+    # la base), ce qui marche aussi sur les tables créées avant le server_default
+    # (create_all ne modifie pas une table existante)
+    purchased_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), nullable=False)
 
     __table_args__ = (
         UniqueConstraint("event_id", "email", name="uq_ticket_purchase_event_email"),
     )
 
-    event = relationship("Event", backref="ticket_purchases")
-    ticket_type = relationship("TicketType", backref="purchases")
+    event = relationship("Event", back_populates="ticket_purchases")
+    ticket_type = relationship("TicketType", back_populates="purchases")
 
 # Shopping item
 from sqlalchemy import UniqueConstraint
@@ -297,5 +376,5 @@ class ShoppingItem(Base):
 
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-    event = relationship("Event", backref="shopping_items")
-    user = relationship("User", backref="shopping_items")
+    event = relationship("Event", back_populates="shopping_items")
+    user = relationship("User", back_populates="shopping_items")
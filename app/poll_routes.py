@@ -1,54 +1,172 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from itertools import groupby
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session, selectinload, raiseload
+from sqlalchemy import select, func, exists, false, or_, literal_column
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.exc import IntegrityError
 
+from .cache import event_member_cache, event_organizer_cache
 from .db import get_db
-from .security import get_current_user, get_current_user_optional
+from .security import CurrentUser, get_current_user, get_current_user_optional
 from .models import (
-    User, Event,
+    Event,
     Poll, PollQuestion, PollOption, PollVote,
     event_participants, event_organizers,
 )
-from .schemas import PollCreate, PollPublic, PollVoteCreate
+from .schemas import PollCreate, PollPublic, PollVoteCreate, poll_to_public
 
 router = APIRouter(prefix="/polls", tags=["polls"])
 
+_poll_list_adapter = TypeAdapter(list[PollPublic])
+
 
 # ---------- Helpers ----------
-def _is_event_member(db: Session, event_id: int, user_id: int) -> bool:
-    is_participant = db.execute(
-        select(event_participants.c.user_id).where(
+def _member_of(event_id, user_id: int):
+    # participant OU organisateur (event_id : valeur ou colonne corrélée, ex. Poll.event_id)
+    return or_(
+        exists().where(
             event_participants.c.event_id == event_id,
             event_participants.c.user_id == user_id,
-        )
-    ).first() is not None
-
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
+        ),
+        exists().where(
             event_organizers.c.event_id == event_id,
             event_organizers.c.user_id == user_id,
+        ),
+    )
+
+
+def _membership(db: Session, event_id: int, user_id: int) -> tuple[bool, bool]:
+    """
+    (participant, organisateur) en une seule requête (2 EXISTS en colonnes).
+    Remplit les deux caches : une vérification de rôle sert aussi à la suivante.
+    """
+    row = db.execute(
+        select(
+            exists().where(
+                event_participants.c.event_id == event_id,
+                event_participants.c.user_id == user_id,
+            ),
+            exists().where(
+                event_organizers.c.event_id == event_id,
+                event_organizers.c.user_id == user_id,
+            ),
         )
-    ).first() is not None
+    ).one()
+    is_participant, is_org = bool(row[0]), bool(row[1])
+    event_member_cache.set((event_id, user_id), is_participant or is_org)
+    event_organizer_cache.set((event_id, user_id), is_org)
+    return is_participant, is_org
+
 
-    return is_participant or is_organizer
+def _is_event_member(db: Session, event_id: int, user_id: int) -> bool:
+    # résultat gardé quelques secondes en mémoire (lectures seulement), partagé avec les discussions
+    # (invalidé par les routes events qui modifient participants / organisateurs)
+    cached = event_member_cache.get((event_id, user_id))
+    if cached is not None:
+        return cached
+    return any(_membership(db, event_id, user_id))
+
+
+def _with_questions():
+    # PollPublic sérialise poll.questions puis question.options : on les charge
+    # en 2 SELECT ... IN groupés au lieu d'un SELECT par poll / par question.
+    # raiseload("*") à chaque niveau : toute autre relation (poll.event, option.question,
+    # ...) lève une erreur au lieu d'un chargement paresseux silencieux (N+1)
+    return (
+        selectinload(Poll.questions).options(
+            selectinload(PollQuestion.options).options(raiseload("*")),
+            raiseload("*"),
+        ),
+        raiseload("*"),
+    )
 
 
-def _is_event_organizer(db: Session, event_id: int, user_id: int) -> bool:
+def _load_poll_ctx(db: Session, poll_id: int, current_user: CurrentUser | None, *columns, options=()):
+    """
+    Une seule requête : les colonnes demandées du sondage (ou l'entité Poll si elle
+    est renvoyée au client), la visibilité de son event et l'appartenance du user
+    à l'event (au lieu de poll -> event -> membership en 3 allers-retours).
+    Retourne None si le sondage n'existe pas.
+    """
+    is_member = false() if current_user is None else _member_of(Poll.event_id, current_user.id)
     return db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == user_id,
-        )
-    ).first() is not None
+        select(*columns, Event.is_public, is_member.label("is_member"))
+        .select_from(Poll)
+        .join(Event, Event.id == Poll.event_id)
+        .options(*options)
+        .where(Poll.id == poll_id)
+    ).one_or_none()
 
 
-def _can_view_event(db: Session, event: Event, current_user: User | None) -> bool:
-    if event.is_public:
+def _can_view_event(db: Session, event_id: int, is_public: bool, current_user: CurrentUser | None) -> bool:
+    if is_public:
         return True
     if current_user is None:
         return False
-    return _is_event_member(db, event.id, current_user.id)
+    return _is_event_member(db, event_id, current_user.id)
+
+
+def _poll_results_json(db: Session, poll_id: int) -> list[dict]:
+    """
+    PostgreSQL : la structure par question est construite par la base
+    (json_agg de json_build_object, options triées par id) ; une ligne par question.
+    """
+    votes = (
+        select(func.count(PollVote.id))
+        .where(PollVote.option_id == PollOption.id)
+        .scalar_subquery()
+    )
+    option_json = func.json_build_object(
+        literal_column("'option_id'"), PollOption.id,
+        literal_column("'label'"), PollOption.label,
+        literal_column("'votes'"), votes,
+    )
+    rows = db.execute(
+        select(
+            PollQuestion.id,
+            PollQuestion.question,
+            func.json_agg(aggregate_order_by(option_json, PollOption.id)),
+        )
+        .join(PollOption, PollOption.question_id == PollQuestion.id)
+        .where(PollQuestion.poll_id == poll_id)
+        .group_by(PollQuestion.id, PollQuestion.question)
+        .order_by(PollQuestion.id)
+    ).all()
+    return [
+        {"question_id": q_id, "question": q_text, "options": options}
+        for q_id, q_text, options in rows
+    ]
+
+
+def _poll_results_rows(db: Session, poll_id: int) -> list[dict]:
+    """
+    Version portable (SQLite) : une seule requête, options du sondage LEFT JOIN
+    votes comptées par option (les options sans vote sortent avec 0), triées par
+    question puis option, puis regroupées par question côté Python.
+    """
+    rows = db.execute(
+        select(PollQuestion.id, PollQuestion.question, PollOption.id, PollOption.label, func.count(PollVote.id))
+        .select_from(PollQuestion)
+        .join(PollOption, PollOption.question_id == PollQuestion.id)
+        .outerjoin(PollVote, PollVote.option_id == PollOption.id)
+        .where(PollQuestion.poll_id == poll_id)
+        .group_by(PollQuestion.id, PollQuestion.question, PollOption.id, PollOption.label)
+        .order_by(PollQuestion.id, PollOption.id)
+    ).all()
+
+    return [
+        {
+            "question_id": q_id,
+            "question": q_text,
+            "options": [
+                {"option_id": opt_id, "label": label, "votes": votes}
+                for _, _, opt_id, label, votes in q_rows
+            ],
+        }
+        for (q_id, q_text), q_rows in groupby(rows, key=lambda r: (r[0], r[1]))
+    ]
 
 
 # ---------- Routes ----------
@@ -56,80 +174,95 @@ def _can_view_event(db: Session, event: Event, current_user: User | None) -> boo
 def create_poll(
     payload: PollCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == payload.event_id)).scalar_one_or_none()
-    if event is None:
+    # existence de l'event + rôle organisateur, en une requête (colonnes seulement)
+    ctx = db.execute(
+        select(
+            Event.id,
+            exists().where(
+                event_organizers.c.event_id == Event.id,
+                event_organizers.c.user_id == current_user.id,
+            ).label("is_org"),
+        ).where(Event.id == payload.event_id)
+    ).one_or_none()
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Event not found")
+    event_organizer_cache.set((payload.event_id, current_user.id), ctx.is_org)
+    if ctx.is_org:
+        # un organisateur est membre de l'event (consultation des sondages ensuite)
+        event_member_cache.set((payload.event_id, current_user.id), True)
 
     # Seul un organizer peut créer un sondage
-    if not _is_event_organizer(db, payload.event_id, current_user.id):
+    if not ctx.is_org:
         raise HTTPException(status_code=403, detail="Only organizers can create polls")
 
+    # Graphe complet (poll -> questions -> options) puis un seul commit (une seule
+    # transaction au lieu d'un commit par question). L'unit of work insère chaque
+    # table en lot : sur PostgreSQL, INSERT multi-lignes ... RETURNING (3 INSERT au
+    # total) ; SQLite ne garantit pas l'ordre du RETURNING, une ligne par INSERT.
     poll = Poll(
         event_id=payload.event_id,
         creator_id=current_user.id,
         title=payload.title,
+        questions=[
+            PollQuestion(
+                question=q.question,
+                options=[PollOption(label=opt.label) for opt in q.options],
+            )
+            for q in payload.questions
+        ],
     )
     db.add(poll)
     db.commit()
-    db.refresh(poll)
 
-    # Créer questions + options
-    for q in payload.questions:
-        question = PollQuestion(poll_id=poll.id, question=q.question)
-        db.add(question)
-        db.commit()
-        db.refresh(question)
-
-        for opt in q.options:
-            option = PollOption(question_id=question.id, label=opt.label)
-            db.add(option)
-
-        db.commit()
-
-    db.refresh(poll)
+    # expire_on_commit=False : questions/options déjà en mémoire, pas de refresh
     return poll
 
 
-@router.get("/by-event/{event_id}", response_model=list[PollPublic])
+# response_model=None : la réponse est déjà sérialisée (poll_to_public, sans
+# revalidation par FastAPI) ; le schéma reste documenté via `responses`
+@router.get("/by-event/{event_id}", response_model=None, responses={200: {"model": list[PollPublic]}})
 def list_polls_by_event(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
+    # seule la visibilité est utile : colonne is_public, pas l'entité Event
+    is_public = db.scalar(select(Event.is_public).where(Event.id == event_id))
+    if is_public is None:
         raise HTTPException(status_code=404, detail="Event not found")
 
-    if not _can_view_event(db, event, current_user):
+    if not _can_view_event(db, event_id, is_public, current_user):
         raise HTTPException(status_code=403, detail="Not allowed to view polls for this event")
 
+    # liste lue entièrement avant la réponse : pas de curseur ouvert pendant que
+    # le client lit, et une erreur SQL donne un 500, pas un 200 tronqué
     polls = db.execute(
-        select(Poll).where(Poll.event_id == event_id).order_by(Poll.created_at.desc())
+        select(Poll)
+        .options(*_with_questions())
+        .where(Poll.event_id == event_id)
+        .order_by(Poll.created_at.desc())
     ).scalars().all()
 
-    return polls
+    body = _poll_list_adapter.dump_json([poll_to_public(p) for p in polls])
+    return Response(content=body, media_type="application/json")
 
 
-@router.get("/{poll_id}", response_model=PollPublic)
+@router.get("/{poll_id}", response_model=None, responses={200: {"model": PollPublic}})
 def get_poll(
     poll_id: int,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
 ):
-    poll = db.execute(select(Poll).where(Poll.id == poll_id)).scalar_one_or_none()
-    if poll is None:
+    ctx = _load_poll_ctx(db, poll_id, current_user, Poll, options=_with_questions())
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Poll not found")
 
-    event = db.execute(select(Event).where(Event.id == poll.event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    if not _can_view_event(db, event, current_user):
+    if not (ctx.is_public or ctx.is_member):
         raise HTTPException(status_code=403, detail="Not allowed to view this poll")
 
-    return poll
+    return Response(poll_to_public(ctx.Poll).model_dump_json(), media_type="application/json")
 
 
 @router.post("/questions/{question_id}/vote", status_code=204)
@@ -137,32 +270,31 @@ def vote_question(
     question_id: int,
     payload: PollVoteCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    question = db.execute(select(PollQuestion).where(PollQuestion.id == question_id)).scalar_one_or_none()
-    if question is None:
+    # question + droit de vote + appartenance de l'option, en une requête
+    # (question -> poll, puis EXISTS corrélés à Poll.event_id / PollQuestion.id)
+    ctx = db.execute(
+        select(
+            PollQuestion.id,
+            _member_of(Poll.event_id, current_user.id).label("is_member"),
+            exists().where(
+                PollOption.id == payload.option_id,
+                PollOption.question_id == PollQuestion.id,
+            ).label("option_ok"),
+        )
+        .join(Poll, Poll.id == PollQuestion.poll_id)
+        .where(PollQuestion.id == question_id)
+    ).one_or_none()
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Question not found")
 
-    poll = db.execute(select(Poll).where(Poll.id == question.poll_id)).scalar_one_or_none()
-    if poll is None:
-        raise HTTPException(status_code=404, detail="Poll not found")
-
-    event = db.execute(select(Event).where(Event.id == poll.event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
     # seuls participants/organizers peuvent voter
-    if not _is_event_member(db, event.id, current_user.id):
+    if not ctx.is_member:
         raise HTTPException(status_code=403, detail="Only event participants/organizers can vote")
 
     # option doit appartenir à cette question
-    option = db.execute(
-        select(PollOption).where(
-            PollOption.id == payload.option_id,
-            PollOption.question_id == question_id,
-        )
-    ).scalar_one_or_none()
-    if option is None:
+    if not ctx.option_ok:
         raise HTTPException(status_code=400, detail="Option does not belong to this question")
 
     vote = PollVote(
@@ -182,48 +314,30 @@ def vote_question(
     return
 
 
-@router.get("/{poll_id}/results")
+@router.get("/{poll_id}/results", response_class=ORJSONResponse)
 def poll_results(
     poll_id: int,
     db: Session = Depends(get_db),
-    current_user: User | None = Depends(get_current_user_optional),
+    current_user: CurrentUser | None = Depends(get_current_user_optional),
 ):
-    poll = db.execute(select(Poll).where(Poll.id == poll_id)).scalar_one_or_none()
-    if poll is None:
+    # seuls id et titre sont renvoyés : pas d'entité Poll
+    ctx = _load_poll_ctx(db, poll_id, current_user, Poll.id, Poll.title)
+    if ctx is None:
         raise HTTPException(status_code=404, detail="Poll not found")
 
-    event = db.execute(select(Event).where(Event.id == poll.event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    if not _can_view_event(db, event, current_user):
+    if not (ctx.is_public or ctx.is_member):
         raise HTTPException(status_code=403, detail="Not allowed to view results")
 
     # Résultats: nb de votes par option, regroupés par question
-    questions = db.execute(select(PollQuestion).where(PollQuestion.poll_id == poll_id)).scalars().all()
-
-    results = []
-    for q in questions:
-        options = db.execute(select(PollOption).where(PollOption.question_id == q.id)).scalars().all()
-
-        option_counts = db.execute(
-            select(PollVote.option_id, func.count(PollVote.id))
-            .where(PollVote.question_id == q.id)
-            .group_by(PollVote.option_id)
-        ).all()
-        counts_map = {opt_id: count for opt_id, count in option_counts}
-
-        results.append({
-            "question_id": q.id,
-            "question": q.question,
-            "options": [
-                {"option_id": o.id, "label": o.label, "votes": counts_map.get(o.id, 0)}
-                for o in options
-            ],
-        })
-
-    return {
-        "poll_id": poll.id,
-        "title": poll.title,
+    if db.get_bind().dialect.name == "postgresql":
+        results = _poll_results_json(db, poll_id)
+    else:
+        results = _poll_results_rows(db, poll_id)
+
+    # dicts imbriqués de types simples : encodés directement par orjson (C),
+    # sans passer par jsonable_encoder
+    return ORJSONResponse({
+        "poll_id": ctx.id,
+        "title": ctx.title,
         "results": results,
-    }
+    })
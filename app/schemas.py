@@ -1,7 +1,39 @@
-from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator, HttpUrl
-from typing import Literal
+from pydantic import BaseModel, BeforeValidator, ConfigDict, EmailStr, Field, StringConstraints, model_validator, WithJsonSchema
+from typing import Annotated, Literal
 from datetime import datetime
 
+# Email déjà validé à l'écriture (EmailStr en entrée) : en sortie, les schémas
+# *Public relisent la base et n'ont pas à repasser par email-validator (appel
+# Python par ligne sérialisée). Même format "email" dans l'OpenAPI.
+PublicEmail = Annotated[str, WithJsonSchema({"type": "string", "format": "email"})]
+
+
+# Nettoyage des chaînes au niveau du champ (avant la validation str + longueur)
+# plutôt qu'un model_validator par schéma : un seul validateur partagé.
+def _strip_nonempty(v):
+    if not isinstance(v, str):
+        return v  # laissé au schéma str (erreur de type standard)
+    v = v.strip()
+    if not v:
+        raise ValueError("must not be empty")
+    return v
+
+
+def _strip_or_none(v):
+    if isinstance(v, str):
+        v = v.strip()
+        return v or None
+    return v
+
+
+NonEmptyStr = Annotated[str, BeforeValidator(_strip_nonempty)]
+StrippedOptionalStr = Annotated[str | None, BeforeValidator(_strip_or_none)]
+
+# URL de photo : simple contrôle du schéma http(s) par la regex Rust de
+# pydantic-core, au lieu du parseur complet de HttpUrl (jusqu'à 100 par requête)
+PhotoUrl = Annotated[str, StringConstraints(pattern=r"^https?://[^\s]+$", max_length=2048)]
+
+
 class UserCreate(BaseModel):
     email: EmailStr
     password: str = Field(min_length=8)
@@ -10,11 +42,10 @@ class UserCreate(BaseModel):
 
 class UserPublic(BaseModel):
     id: int
-    email: EmailStr
+    email: PublicEmail
     full_name: str | None = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class Token(BaseModel):
@@ -32,7 +63,7 @@ GroupType = Literal["public", "private", "secret"]
 
 
 class GroupCreate(BaseModel):
-    name: str = Field(min_length=1, max_length=120)
+    name: NonEmptyStr = Field(min_length=1, max_length=120)
     description: str | None = Field(default=None, max_length=2000)
     icon_url: str | None = None
     cover_url: str | None = None
@@ -40,17 +71,9 @@ class GroupCreate(BaseModel):
     allow_member_posts: bool = True
     allow_member_events: bool = False
 
-    @field_validator("name")
-    @classmethod
-    def strip_name(cls, v: str) -> str:
-        v = v.strip()
-        if not v:
-            raise ValueError("name cannot be empty")
-        return v
-
 
 class GroupUpdate(BaseModel):
-    name: str | None = Field(default=None, min_length=1, max_length=120)
+    name: NonEmptyStr | None = Field(default=None, min_length=1, max_length=120)
     description: str | None = Field(default=None, max_length=2000)
     icon_url: str | None = None
     cover_url: str | None = None
@@ -58,16 +81,6 @@ class GroupUpdate(BaseModel):
     allow_member_posts: bool | None = None
     allow_member_events: bool | None = None
 
-    @field_validator("name")
-    @classmethod
-    def strip_name(cls, v: str | None) -> str | None:
-        if v is None:
-            return v
-        v = v.strip()
-        if not v:
-            raise ValueError("name cannot be empty")
-        return v
-
 
 class GroupPublic(BaseModel):
     id: int
@@ -79,8 +92,7 @@ class GroupPublic(BaseModel):
     allow_member_posts: bool
     allow_member_events: bool
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class EventCreate(BaseModel):
@@ -116,8 +128,7 @@ class EventPublic(BaseModel):
     is_public: bool
     group_id: int | None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Schema Discussions
@@ -142,23 +153,14 @@ class DiscussionPublic(BaseModel):
     event_id: int | None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 #Schema Message
 class MessageCreate(BaseModel):
-    content: str = Field(min_length=1, max_length=2000)
+    content: NonEmptyStr = Field(min_length=1, max_length=2000)
     parent_message_id: int | None = None 
 
-    @model_validator(mode="after")
-    def strip_and_validate(self):
-        cleaned = self.content.strip()
-        if not cleaned:
-            raise ValueError("content must not be empty")
-        self.content = cleaned
-        return self
-
 
 class MessagePublic(BaseModel):
     id: int
@@ -168,24 +170,16 @@ class MessagePublic(BaseModel):
     content: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 
 # Schema album
 class AlbumCreate(BaseModel):
     event_id: int
-    title: str = Field(min_length=1, max_length=255)
+    title: NonEmptyStr = Field(min_length=1, max_length=255)
     description: str | None = Field(default=None, max_length=2000)
 
-    @model_validator(mode="after")
-    def strip_title(self):
-        self.title = self.title.strip()
-        if not self.title:
-            raise ValueError("title must not be empty")
-        return self
-
 
 class AlbumPublic(BaseModel):
     id: int
@@ -193,23 +187,19 @@ class AlbumPublic(BaseModel):
     title: str
     description: str | None
     created_at: datetime
+    photo_count: int = 0
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Schema photos
 class PhotoCreate(BaseModel):
-    url: HttpUrl
-    caption: str | None = Field(default=None, max_length=2000)
+    url: PhotoUrl
+    caption: StrippedOptionalStr = Field(default=None, max_length=2000)
 
-    @model_validator(mode="after")
-    def clean_caption(self):
-        if self.caption is not None:
-            self.caption = self.caption.strip()
-            if self.caption == "":
-                self.caption = None
-        return self
+
+class PhotoBulkCreate(BaseModel):
+    photos: list[PhotoCreate] = Field(min_length=1, max_length=100)
 
 
 class PhotoPublic(BaseModel):
@@ -220,20 +210,12 @@ class PhotoPublic(BaseModel):
     caption: str | None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Schema commentaires
 class PhotoCommentCreate(BaseModel):
-    content: str = Field(min_length=1, max_length=2000)
-
-    @model_validator(mode="after")
-    def clean_content(self):
-        self.content = self.content.strip()
-        if not self.content:
-            raise ValueError("content must not be empty")
-        return self
+    content: NonEmptyStr = Field(min_length=1, max_length=2000)
 
 
 class PhotoCommentPublic(BaseModel):
@@ -243,40 +225,32 @@ class PhotoCommentPublic(BaseModel):
     content: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Sous-schéma option
 class PollOptionCreate(BaseModel):
-    label: str = Field(min_length=1, max_length=255)
-
-    @model_validator(mode="after")
-    def strip_label(self):
-        self.label = self.label.strip()
-        if not self.label:
-            raise ValueError("label must not be empty")
-        return self
+    label: NonEmptyStr = Field(min_length=1, max_length=255)
 
 
 # Sous-schéma question
 class PollQuestionCreate(BaseModel):
-    question: str = Field(min_length=1, max_length=2000)
+    question: NonEmptyStr = Field(min_length=1, max_length=2000)
     options: list[PollOptionCreate]
 
     @model_validator(mode="after")
     def validate_options(self):
-        self.question = self.question.strip()
-        if not self.question:
-            raise ValueError("question must not be empty")
-
         if len(self.options) < 2:
             raise ValueError("each question must have at least 2 options")
 
-        # éviter doublons d'options (insensible à la casse/espaces)
-        normalized = [o.label.strip().lower() for o in self.options]
-        if len(set(normalized)) != len(normalized):
-            raise ValueError("options must be unique per question")
+        # éviter doublons d'options (insensible à la casse ; labels déjà strippés) :
+        # un seul passage, arrêt au premier doublon
+        seen = set()
+        for o in self.options:
+            key = o.label.lower()
+            if key in seen:
+                raise ValueError("options must be unique per question")
+            seen.add(key)
 
         return self
 
@@ -284,15 +258,11 @@ class PollQuestionCreate(BaseModel):
 # Schéma principal PollCreate
 class PollCreate(BaseModel):
     event_id: int
-    title: str = Field(min_length=1, max_length=255)
+    title: NonEmptyStr = Field(min_length=1, max_length=255)
     questions: list[PollQuestionCreate]
 
     @model_validator(mode="after")
     def validate_poll(self):
-        self.title = self.title.strip()
-        if not self.title:
-            raise ValueError("title must not be empty")
-
         if len(self.questions) < 1:
             raise ValueError("a poll must contain at least 1 question")
 
@@ -306,8 +276,7 @@ class PollOptionPublic(BaseModel):
     question_id: int
     label: str
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Question public
 class PollQuestionPublic(BaseModel):
@@ -316,8 +285,7 @@ class PollQuestionPublic(BaseModel):
     question: str
     options: list[PollOptionPublic] = []
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Poll public
 class PollPublic(BaseModel):
@@ -328,8 +296,34 @@ class PollPublic(BaseModel):
     created_at: datetime
     questions: list[PollQuestionPublic] = []
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+def poll_to_public(poll) -> PollPublic:
+    """
+    PollPublic construit sans validation (model_construct) depuis un Poll ORM dont
+    questions et options sont déjà chargées : données lues en base, donc déjà
+    valides, sans le coût de from_attributes pour chaque question / option.
+    """
+    return PollPublic.model_construct(
+        id=poll.id,
+        event_id=poll.event_id,
+        creator_id=poll.creator_id,
+        title=poll.title,
+        created_at=poll.created_at,
+        questions=[
+            PollQuestionPublic.model_construct(
+                id=q.id,
+                poll_id=q.poll_id,
+                question=q.question,
+                options=[
+                    PollOptionPublic.model_construct(id=o.id, question_id=o.question_id, label=o.label)
+                    for o in q.options
+                ],
+            )
+            for q in poll.questions
+        ],
+    )
+
 
 # Voter
 class PollVoteCreate(BaseModel):
@@ -352,8 +346,7 @@ class TicketTypePublic(BaseModel):
     quantity_limit: int
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TicketPurchaseCreate(BaseModel):
@@ -368,14 +361,20 @@ class TicketPurchasePublic(BaseModel):
     id: int
     event_id: int
     ticket_type_id: int
-    email: EmailStr
+    email: PublicEmail
     first_name: str
     last_name: str
     address: str
     purchased_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Tableau de bord organisateur : types, achats et ventes par type en une réponse
+class TicketOverviewPublic(BaseModel):
+    types: list[TicketTypePublic]
+    purchases: list[TicketPurchasePublic]
+    sold_by_type: dict[int, int]  # {ticket_type_id: billets vendus}
 
 
 # Shopping
@@ -389,6 +388,15 @@ class ShoppingItemUpdate(BaseModel):
     quantity: int | None = Field(default=None, gt=0)
     arrival_time: datetime | None = None
 
+    @model_validator(mode="after")
+    def check_no_null(self):
+        # PATCH : un champ absent est ignoré, mais null explicite est refusé
+        # (les colonnes sont NOT NULL)
+        for name in self.model_fields_set:
+            if getattr(self, name) is None:
+                raise ValueError(f"{name} must not be null")
+        return self
+
 class ShoppingItemPublic(BaseModel):
     id: int
     event_id: int
@@ -399,6 +407,23 @@ class ShoppingItemPublic(BaseModel):
 
     created_by: dict  # {id,email,full_name}
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+def shopping_item_to_public(item, created_by) -> ShoppingItemPublic:
+    """
+    ShoppingItemPublic construit sans validation (model_construct) depuis un
+    ShoppingItem ORM et son créateur (User ou CurrentUser) : données serveur.
+    """
+    return ShoppingItemPublic.model_construct(
+        id=item.id,
+        event_id=item.event_id,
+        name=item.name,
+        quantity=item.quantity,
+        arrival_time=item.arrival_time,
+        created_at=item.created_at,
+        created_by=(
+            {"id": created_by.id, "email": created_by.email, "full_name": created_by.full_name}
+            if created_by is not None else None
+        ),
+    )
 
@@ -1,33 +1,67 @@
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
-from passlib.context import CryptContext
-from sqlalchemy import select
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from jose import jwk, jwt, JWTError
 from sqlalchemy.orm import Session
 
+from .cache import token_cache, user_cache
 from .db import get_db
 from .models import User
 
 # ---- Password hashing ----
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# argon2id via argon2-cffi directement (sans la couche de dispatch de passlib) :
+# ~150 ms CPU et 64 Mo de mémoire par hash. Paramètres explicites = ceux déjà
+# utilisés (profil RFC 9106 "low memory") : les hash existants restent valides.
+_password_hasher = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=4)
 
+# appelés directement : les routes auth sont synchrones et tournent déjà dans le
+# threadpool, hors de la boucle d'événements
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return _password_hasher.hash(password)
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(password, hashed_password)
+    try:
+        return _password_hasher.verify(hashed_password, password)
+    except (VerificationError, InvalidHashError):
+        # mauvais mot de passe (VerifyMismatchError) ou hash illisible
+        return False
 
 # ---- JWT config ----
 SECRET_KEY = "CHANGE_ME_SUPER_SECRET"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-def create_access_token(subject: str) -> str:
+# Clé HMAC construite une seule fois (backend cryptography / OpenSSL) : passée en
+# objet Key, jose ne retente plus json.loads sur le secret ni jwk.construct à
+# chaque encode / decode
+_signing_key = jwk.construct(SECRET_KEY, ALGORITHM)
+_algorithms = [ALGORITHM]
+
+def create_access_token(subject: str, email: str | None = None, full_name: str | None = None) -> str:
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {"sub": subject, "exp": expire}
-    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    # identité embarquée dans le token : get_current_user n'a plus besoin de la base
+    if email is not None:
+        payload["email"] = email
+        payload["name"] = full_name
+    return jwt.encode(payload, _signing_key, algorithm=ALGORITHM)
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """
+    Utilisateur authentifié, construit depuis les claims du JWT (sans SELECT).
+    Les routes n'utilisent que id / email / full_name ; pour une relation ORM
+    (ex. group.members), charger le User avec db.get(User, current_user.id).
+    """
+    id: int
+    email: str
+    full_name: str | None = None
 
 # ---- Bearer schemes ----
 # auto_error=True => si pas de token => FastAPI renvoie direct 403 "Not authenticated"
@@ -37,27 +71,52 @@ bearer_required = HTTPBearer(auto_error=True)
 bearer_optional = HTTPBearer(auto_error=False)
 
 # ---- Helpers ----
-def _decode_user_from_token(token: str, db: Session) -> User | None:
+def _decode_user_from_token(token: str, db: Session) -> CurrentUser | None:
     """
-    Décode le JWT, récupère user_id depuis 'sub', et retourne l'utilisateur si existe.
+    Décode le JWT et retourne l'utilisateur courant depuis ses claims.
+    Les anciens tokens (sans claim 'email') retombent sur une lecture en base.
     Retourne None si token invalide / user absent.
     """
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        if sub is None:
+    # token déjà vérifié : seul l'exp reste à contrôler (pas de HMAC ni de JSON)
+    hit = token_cache.get(token)
+    if hit is not None and hit[2] > time.time():
+        user_id, claims_user, _ = hit
+    else:
+        try:
+            payload = jwt.decode(token, _signing_key, algorithms=_algorithms)
+            sub = payload.get("sub")
+            if sub is None:
+                return None
+            user_id = int(sub)
+        except (JWTError, ValueError):
             return None
-        user_id = int(sub)
-    except (JWTError, ValueError):
-        return None
 
-    return db.execute(select(User).where(User.id == user_id)).scalar_one_or_none()
+        claims_user = None
+        if "email" in payload:
+            claims_user = CurrentUser(id=user_id, email=payload["email"], full_name=payload.get("name"))
+        # sans exp, le token n'expire jamais côté jose : on ne le met pas en cache
+        if isinstance(payload.get("exp"), (int, float)):
+            token_cache.set(token, (user_id, claims_user, payload["exp"]))
+
+    if claims_user is not None:
+        return claims_user
+
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    user = db.get(User, user_id)
+    if user is None:
+        return None
+    current = CurrentUser(id=user.id, email=user.email, full_name=user.full_name)
+    user_cache.set(user_id, current)
+    return current
 
 # ---- Dependencies ----
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(bearer_required),
     db: Session = Depends(get_db),
-) -> User:
+) -> CurrentUser:
     user = _decode_user_from_token(credentials.credentials, db)
     if user is None:
         raise HTTPException(
@@ -70,7 +129,7 @@ def get_current_user(
 def get_current_user_optional(
     credentials: HTTPAuthorizationCredentials | None = Depends(bearer_optional),
     db: Session = Depends(get_db),
-) -> User | None:
+) -> CurrentUser | None:
     if credentials is None:
         return None
     return _decode_user_from_token(credentials.credentials, db)
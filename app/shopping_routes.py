@@ -1,34 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, exists, insert
+from sqlalchemy.exc import IntegrityError
 
-from .db import get_db
+from .cache import event_member_cache, event_organizer_cache
+from .db import get_db, is_unique_violation
 from .models import Event, User, ShoppingItem, event_participants, event_organizers
-from .schemas import ShoppingItemCreate, ShoppingItemUpdate, ShoppingItemPublic
-from .security import get_current_user
+from .schemas import ShoppingItemCreate, ShoppingItemUpdate, ShoppingItemPublic, shopping_item_to_public
+from .security import CurrentUser, get_current_user
 
 router = APIRouter(prefix="/events/{event_id}/shopping-items", tags=["shopping"])
 
+# sérialiseur de la liste construit une fois pour toutes (pydantic-core, en Rust)
+_item_list_adapter = TypeAdapter(list[ShoppingItemPublic])
+
+
+def _load_shopping_ctx(db: Session, event_id: int, user_id: int):
+    """
+    Une seule requête : shopping_list_enabled de l'event, si l'utilisateur y est
+    participant et s'il en est organisateur. Remplit les caches de rôles partagés.
+    Retourne None si l'event n'existe pas.
+    """
+    ctx = db.execute(
+        select(
+            Event.shopping_list_enabled,
+            exists().where(
+                event_participants.c.event_id == Event.id,
+                event_participants.c.user_id == user_id,
+            ).label("is_participant"),
+            exists().where(
+                event_organizers.c.event_id == Event.id,
+                event_organizers.c.user_id == user_id,
+            ).label("is_organizer"),
+        ).where(Event.id == event_id)
+    ).one_or_none()
+    if ctx is not None:
+        event_member_cache.set((event_id, user_id), ctx.is_participant or ctx.is_organizer)
+        event_organizer_cache.set((event_id, user_id), ctx.is_organizer)
+    return ctx
+
+
+def require_shopping_list(ctx):
+    if ctx is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if not ctx.shopping_list_enabled:
+        raise HTTPException(status_code=400, detail="Shopping list is not enabled for this event")
 
-def is_event_member(db: Session, event_id: int, user_id: int) -> bool:
-    is_org = db.execute(
-        select(event_organizers.c.user_id).where(
-            (event_organizers.c.event_id == event_id) &
-            (event_organizers.c.user_id == user_id)
-        )
-    ).first() is not None
-
-    if is_org:
-        return True
 
-    is_participant = db.execute(
-        select(event_participants.c.user_id).where(
-            (event_participants.c.event_id == event_id) &
-            (event_participants.c.user_id == user_id)
-        )
-    ).first() is not None
-
-    return is_participant
+def require_event_member(ctx):
+    if not (ctx.is_participant or ctx.is_organizer):
+        raise HTTPException(status_code=403, detail="You must be a participant or organizer")
 
 
 @router.post("", response_model=ShoppingItemPublic, status_code=201)
@@ -36,83 +58,60 @@ def create_item(
     event_id: int,
     payload: ShoppingItemCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    if not event.shopping_list_enabled:
-        raise HTTPException(status_code=400, detail="Shopping list is not enabled for this event")
-
-    if not is_event_member(db, event_id, current_user.id):
-        raise HTTPException(status_code=403, detail="You must be a participant or organizer")
-
-    # Unicité par event (check applicatif en plus de la contrainte DB)
-    existing = db.execute(
-        select(ShoppingItem).where(
-            (ShoppingItem.event_id == event_id) &
-            (ShoppingItem.name == payload.name)
-        )
-    ).scalar_one_or_none()
-    if existing:
+    # event + shopping_list_enabled + rôle de l'utilisateur, en une requête
+    ctx = _load_shopping_ctx(db, event_id, current_user.id)
+    require_shopping_list(ctx)
+    require_event_member(ctx)
+
+    # INSERT ... RETURNING : id et created_at relus dans le même aller-retour (pas de refresh).
+    # Unicité par event garantie par uq_shopping_item_event_name : pas de SELECT préalable
+    try:
+        item = db.execute(
+            insert(ShoppingItem)
+            .values(
+                event_id=event_id,
+                user_id=current_user.id,
+                name=payload.name,
+                quantity=payload.quantity,
+                arrival_time=payload.arrival_time,
+            )
+            .returning(ShoppingItem)
+        ).scalar_one()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if not is_unique_violation(e, ShoppingItem, "uq_shopping_item_event_name"):
+            raise
         raise HTTPException(status_code=409, detail="This item already exists for this event")
 
-    item = ShoppingItem(
-        event_id=event_id,
-        user_id=current_user.id,
-        name=payload.name,
-        quantity=payload.quantity,
-        arrival_time=payload.arrival_time,
-    )
-    db.add(item)
-    db.commit()
-    db.refresh(item)
-
-    return {
-        "id": item.id,
-        "event_id": item.event_id,
-        "name": item.name,
-        "quantity": item.quantity,
-        "arrival_time": item.arrival_time,
-        "created_at": item.created_at,
-        "created_by": {"id": current_user.id, "email": current_user.email, "full_name": current_user.full_name},
-    }
+    return shopping_item_to_public(item, current_user)
 
 
-@router.get("", response_model=list[ShoppingItemPublic])
+@router.get("", response_model=None, responses={200: {"model": list[ShoppingItemPublic]}})
 def list_items(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
+    # event + shopping_list_enabled + rôle de l'utilisateur, en une requête
+    ctx = _load_shopping_ctx(db, event_id, current_user.id)
+    require_shopping_list(ctx)
+    require_event_member(ctx)
 
-    if not event.shopping_list_enabled:
-        raise HTTPException(status_code=400, detail="Shopping list is not enabled for this event")
-
-    if not is_event_member(db, event_id, current_user.id):
-        raise HTTPException(status_code=403, detail="You must be a participant or organizer")
+    # items + créateur en une seule requête (jointure) au lieu d'un SELECT User par item
+    rows = db.execute(
+        select(ShoppingItem, User)
+        .outerjoin(User, User.id == ShoppingItem.user_id)
+        .where(ShoppingItem.event_id == event_id)
+        .order_by(ShoppingItem.created_at.desc())
+    ).all()
 
-    items = db.execute(
-        select(ShoppingItem).where(ShoppingItem.event_id == event_id).order_by(ShoppingItem.created_at.desc())
-    ).scalars().all()
-
-    result = []
-    for it in items:
-        u = db.execute(select(User).where(User.id == it.user_id)).scalar_one_or_none()
-        result.append({
-            "id": it.id,
-            "event_id": it.event_id,
-            "name": it.name,
-            "quantity": it.quantity,
-            "arrival_time": it.arrival_time,
-            "created_at": it.created_at,
-            "created_by": {"id": u.id, "email": u.email, "full_name": u.full_name} if u else None,
-        })
-    return result
+    # objets construits côté serveur (model_construct) : sérialisés directement
+    # en JSON, sans revalidation par FastAPI
+    items = [shopping_item_to_public(it, u) for it, u in rows]
+    return Response(_item_list_adapter.dump_json(items), media_type="application/json")
 
 
 # update item
@@ -122,14 +121,11 @@ def update_item(
     item_id: int,
     payload: ShoppingItemUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    if not event.shopping_list_enabled:
-        raise HTTPException(status_code=400, detail="Shopping list is not enabled for this event")
+    # event + shopping_list_enabled + rôle de l'utilisateur, en une requête
+    ctx = _load_shopping_ctx(db, event_id, current_user.id)
+    require_shopping_list(ctx)
 
     item = db.execute(
         select(ShoppingItem).where(
@@ -141,35 +137,24 @@ def update_item(
         raise HTTPException(status_code=404, detail="Shopping item not found")
 
     # droits : créateur OU organizer
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-
-    if item.user_id != current_user.id and not is_organizer:
+    if item.user_id != current_user.id and not ctx.is_organizer:
         raise HTTPException(status_code=403, detail="Not allowed to update this item")
 
-    for k, v in payload.model_dump(exclude_unset=True).items():
-        setattr(item, k, v)
-
-    db.commit()
+    # champs envoyés par le client seulement, lus sur le modèle (sans model_dump)
+    for k in payload.model_fields_set:
+        setattr(item, k, getattr(payload, k))
+
+    try:
+        db.commit()
+    except IntegrityError as e:
+        # renommage vers un nom déjà pris sur cet event ; toute autre erreur d'intégrité => 500
+        db.rollback()
+        if not is_unique_violation(e, ShoppingItem, "uq_shopping_item_event_name"):
+            raise
+        raise HTTPException(status_code=409, detail="This item already exists for this event")
     db.refresh(item)
 
-    return {
-        "id": item.id,
-        "event_id": item.event_id,
-        "name": item.name,
-        "quantity": item.quantity,
-        "arrival_time": item.arrival_time,
-        "created_at": item.created_at,
-        "created_by": {
-            "id": current_user.id,
-            "email": current_user.email,
-            "full_name": current_user.full_name,
-        },
-    }
+    return shopping_item_to_public(item, current_user)
 
 
 # delete item
@@ -178,14 +163,11 @@ def delete_item(
     event_id: int,
     item_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-
-    if not event.shopping_list_enabled:
-        raise HTTPException(status_code=400, detail="Shopping list is not enabled for this event")
+    # event + shopping_list_enabled + rôle de l'utilisateur, en une requête
+    ctx = _load_shopping_ctx(db, event_id, current_user.id)
+    require_shopping_list(ctx)
 
     item = db.execute(
         select(ShoppingItem).where(
@@ -196,14 +178,7 @@ def delete_item(
     if item is None:
         raise HTTPException(status_code=404, detail="Shopping item not found")
 
-    is_organizer = db.execute(
-        select(event_organizers.c.user_id).where(
-            event_organizers.c.event_id == event_id,
-            event_organizers.c.user_id == current_user.id,
-        )
-    ).first() is not None
-
-    if item.user_id != current_user.id and not is_organizer:
+    if item.user_id != current_user.id and not ctx.is_organizer:
         raise HTTPException(status_code=403, detail="Not allowed to delete this item")
 
     db.delete(item)
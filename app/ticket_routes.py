@@ -1,41 +1,90 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+import hashlib
+from typing import NamedTuple
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session, raiseload
+from sqlalchemy import select, exists, insert, update, lambda_stmt
+from sqlalchemy.exc import IntegrityError
 
-from .db import get_db
-from .models import Event, TicketType, TicketPurchase, User, event_organizers
+from .cache import TTLCache, event_organizer_cache, event_public_cache
+from .db import get_db, is_unique_violation
+from .models import Event, TicketType, TicketPurchase, event_organizers
 from .schemas import (
     TicketTypeCreate,
     TicketTypePublic,
     TicketPurchaseCreate,
     TicketPurchasePublic,
+    TicketOverviewPublic,
 )
-from .security import get_current_user
+from .security import CurrentUser, get_current_user
 
 router = APIRouter(prefix="/events", tags=["tickets"])
 
+# Types de billets d'un event public : même réponse pour tous, rarement modifiée.
+# JSON + ETag gardés 30s en mémoire, clé event_id (invalidé par create_ticket_type).
+# Cache propre au processus (pas de Redis) : seul le worker qui crée le type est
+# invalidé, les autres peuvent renvoyer l'ancienne liste et son ETag jusqu'à 30s.
+_types_cache = TTLCache(maxsize=1024, ttl=30)
+_type_list_adapter = TypeAdapter(list[TicketTypePublic])
+_purchase_list_adapter = TypeAdapter(list[TicketPurchasePublic])
+TYPES_MAX_AGE = 30
 
-def _ensure_event_exists(db: Session, event_id: int) -> Event:
-    event = db.execute(select(Event).where(Event.id == event_id)).scalar_one_or_none()
-    if event is None:
-        raise HTTPException(status_code=404, detail="Event not found")
-    return event
 
+class _EventCtx(NamedTuple):
+    is_public: bool
+    is_organizer: bool | None = None
 
-def _ensure_event_is_public(event: Event):
-    if not event.is_public:
-        raise HTTPException(status_code=403, detail="Ticketing is only available for public events")
 
+def _load_event_ctx(db: Session, event_id: int, user_id: int | None = None, cached: bool = True):
+    """
+    is_public de l'event et, si user_id est fourni, si l'utilisateur en est
+    organisateur : lus dans les caches mémoire, sinon en une seule requête
+    (qui remplit ces caches). cached=False (écritures) : rôle toujours relu en base.
+    Retourne None si l'event n'existe pas.
+    """
+    is_public = event_public_cache.get(event_id)
+    if is_public is not None and (cached or user_id is None):
+        if user_id is None:
+            return _EventCtx(is_public)
+        is_org = event_organizer_cache.get((event_id, user_id))
+        if is_org is not None:
+            return _EventCtx(is_public, is_org)
+
+    # lambda_stmt : SQL compilé mis en cache, une variante par cas anonyme / organisateur
+    if user_id is None:
+        ctx = db.execute(
+            lambda_stmt(lambda: select(Event.is_public).where(Event.id == event_id))
+        ).one_or_none()
+        if ctx is not None:
+            event_public_cache.set(event_id, ctx.is_public)
+        return ctx
 
-def _ensure_current_user_is_organizer(db: Session, event_id: int, user_id: int):
-    is_org = db.execute(
-        select(event_organizers.c.user_id).where(
-            (event_organizers.c.event_id == event_id)
-            & (event_organizers.c.user_id == user_id)
+    ctx = db.execute(
+        lambda_stmt(
+            lambda: select(
+                Event.is_public,
+                exists().where(
+                    event_organizers.c.event_id == Event.id,
+                    event_organizers.c.user_id == user_id,
+                ).label("is_organizer"),
+            ).where(Event.id == event_id)
         )
-    ).first()
-    if not is_org:
+    ).one_or_none()
+    if ctx is not None:
+        event_public_cache.set(event_id, ctx.is_public)
+        event_organizer_cache.set((event_id, user_id), ctx.is_organizer)
+    return ctx
+
+
+def _ensure_public_event(ctx):
+    if ctx is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if not ctx.is_public:
+        raise HTTPException(status_code=403, detail="Ticketing is only available for public events")
+
+
+def _ensure_organizer(ctx):
+    if not ctx.is_organizer:
         raise HTTPException(status_code=403, detail="Only organizers can manage ticketing")
 
 
@@ -45,32 +94,55 @@ def create_ticket_type(
     event_id: int,
     payload: TicketTypeCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = _ensure_event_exists(db, event_id)
-    _ensure_event_is_public(event)
-    _ensure_current_user_is_organizer(db, event_id, current_user.id)
-
-    tt = TicketType(
-        event_id=event_id,
-        name=payload.name,
-        amount=payload.amount,
-        quantity_limit=payload.quantity_limit,
-    )
-    db.add(tt)
+    # event + is_public + rôle organisateur, en une requête (sans cache : écriture)
+    ctx = _load_event_ctx(db, event_id, current_user.id, cached=False)
+    _ensure_public_event(ctx)
+    _ensure_organizer(ctx)
+
+    # INSERT ... RETURNING : id et created_at relus dans le même aller-retour (pas de refresh)
+    tt = db.execute(
+        insert(TicketType)
+        .values(
+            event_id=event_id,
+            name=payload.name,
+            amount=payload.amount,
+            quantity_limit=payload.quantity_limit,
+        )
+        .returning(TicketType)
+    ).scalar_one()
     db.commit()
-    db.refresh(tt)
+    _types_cache.pop(event_id)
     return tt
 
 
 # B) List ticket types (public for public events)
-@router.get("/{event_id}/tickets/types", response_model=list[TicketTypePublic])
-def list_ticket_types(event_id: int, db: Session = Depends(get_db)):
-    event = _ensure_event_exists(db, event_id)
-    _ensure_event_is_public(event)
+@router.get("/{event_id}/tickets/types", response_model=None, responses={200: {"model": list[TicketTypePublic]}})
+def list_ticket_types(
+    event_id: int,
+    db: Session = Depends(get_db),
+    if_none_match: str | None = Header(default=None),
+):
+    cached = _types_cache.get(event_id)
+    if cached is None:
+        _ensure_public_event(_load_event_ctx(db, event_id))
+
+        # TicketTypePublic n'expose aucune relation : raiseload("*") en garde-fou (N+1)
+        items = db.execute(
+            select(TicketType).options(raiseload("*")).where(TicketType.event_id == event_id)
+        ).scalars().all()
+        body = _type_list_adapter.dump_json([TicketTypePublic.model_validate(t) for t in items])
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        cached = (body, etag)
+        _types_cache.set(event_id, cached)
 
-    items = db.execute(select(TicketType).where(TicketType.event_id == event_id)).scalars().all()
-    return items
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TYPES_MAX_AGE}"}
+    # GET conditionnel : le client a déjà cette version
+    if if_none_match is not None and etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 # C) Purchase (no auth) - 1 purchase per email per event
@@ -80,60 +152,129 @@ def purchase_ticket(
     payload: TicketPurchaseCreate,
     db: Session = Depends(get_db),
 ):
-    event = _ensure_event_exists(db, event_id)
-    _ensure_event_is_public(event)
+    _ensure_public_event(_load_event_ctx(db, event_id))
 
-    tt = db.execute(
-        select(TicketType).where(
-            (TicketType.id == payload.ticket_type_id) & (TicketType.event_id == event_id)
-        )
-    ).scalar_one_or_none()
-    if tt is None:
-        raise HTTPException(status_code=404, detail="Ticket type not found for this event")
+    # variable locale : capturée comme paramètre lié par les lambda_stmt
+    ticket_type_id = payload.ticket_type_id
 
-    # already purchased?
-    already = db.execute(
-        select(TicketPurchase.id).where(
-            (TicketPurchase.event_id == event_id) & (TicketPurchase.email == payload.email)
+    # réservation atomique d'une place : l'UPDATE ne touche la ligne que s'il
+    # reste du stock (verrou de ligne jusqu'au commit), donc pas de survente
+    # possible entre deux achats concurrents
+    reserved_id = db.execute(
+        lambda_stmt(
+            lambda: update(TicketType)
+            .where(
+                TicketType.id == ticket_type_id,
+                TicketType.event_id == event_id,
+                TicketType.sold_count < TicketType.quantity_limit,
+            )
+            .values(sold_count=TicketType.sold_count + 1)
+            .returning(TicketType.id)
         )
-    ).first()
-    if already:
-        raise HTTPException(status_code=409, detail="This email already purchased a ticket for this event")
+    ).scalar_one_or_none()
 
-    # stock check
-    sold = db.execute(
-        select(func.count(TicketPurchase.id)).where(TicketPurchase.ticket_type_id == tt.id)
-    ).scalar_one()
-    if sold >= tt.quantity_limit:
+    if reserved_id is None:
+        # rien réservé : type de billet absent, déjà acheté, ou épuisé (chemin
+        # d'échec uniquement) ; même priorité des erreurs qu'avant le compteur
+        tt_exists, already = db.execute(
+            select(
+                exists().where(
+                    (TicketType.id == ticket_type_id) & (TicketType.event_id == event_id)
+                ),
+                exists().where(
+                    (TicketPurchase.event_id == event_id) & (TicketPurchase.email == str(payload.email))
+                ),
+            )
+        ).one()
+        db.rollback()
+        if not tt_exists:
+            raise HTTPException(status_code=404, detail="Ticket type not found for this event")
+        if already:
+            raise HTTPException(status_code=409, detail="This email already purchased a ticket for this event")
         raise HTTPException(status_code=409, detail="Sold out")
 
-    purchase = TicketPurchase(
-        event_id=event_id,
-        ticket_type_id=tt.id,
-        email=str(payload.email),
-        first_name=payload.first_name,
-        last_name=payload.last_name,
-        address=payload.address,
-        purchased_at=datetime.utcnow(),
-    )
-    db.add(purchase)
-    db.commit()
-    db.refresh(purchase)
+    # un achat par email et par event : garanti par uq_ticket_purchase_event_email ;
+    # le rollback annule aussi la place réservée ci-dessus
+    try:
+        # pas de lambda_stmt ici : sous forme lambda, RETURNING renverrait des
+        # colonnes brutes et non l'entité TicketPurchase
+        purchase = db.execute(
+            insert(TicketPurchase)
+            .values(
+                event_id=event_id,
+                ticket_type_id=reserved_id,
+                email=str(payload.email),
+                first_name=payload.first_name,
+                last_name=payload.last_name,
+                address=payload.address,
+            )
+            .returning(TicketPurchase)
+        ).scalar_one()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        # seule la contrainte d'unicité signifie "déjà acheté" ; le reste est une vraie erreur (500)
+        if not is_unique_violation(e, TicketPurchase, "uq_ticket_purchase_event_email"):
+            raise
+        raise HTTPException(status_code=409, detail="This email already purchased a ticket for this event")
+
     return purchase
 
 
 # D) List purchases (organizer only)
-@router.get("/{event_id}/tickets/purchases", response_model=list[TicketPurchasePublic])
+@router.get("/{event_id}/tickets/purchases", response_model=None, responses={200: {"model": list[TicketPurchasePublic]}})
 def list_purchases(
     event_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    event = _ensure_event_exists(db, event_id)
-    _ensure_event_is_public(event)
-    _ensure_current_user_is_organizer(db, event_id, current_user.id)
+    # event + is_public + rôle organisateur, en une requête
+    ctx = _load_event_ctx(db, event_id, current_user.id)
+    _ensure_public_event(ctx)
+    _ensure_organizer(ctx)
 
-    items = db.execute(
-        select(TicketPurchase).where(TicketPurchase.event_id == event_id)
+    # TicketPurchasePublic n'expose que ticket_type_id (colonne) : aucune relation
+    # à charger ; raiseload("*") fait échouer tout accès paresseux (N+1).
+    # Liste lue entièrement avant la réponse (pas de curseur ouvert pendant que le
+    # client lit, erreur SQL => 500 et non un 200 tronqué), chaque achat validé une
+    # seule fois puis la liste sérialisée en un seul appel
+    purchases = db.execute(
+        select(TicketPurchase)
+        .options(raiseload("*"))
+        .where(TicketPurchase.event_id == event_id)
+        .order_by(TicketPurchase.id)
     ).scalars().all()
-    return items
+
+    body = _purchase_list_adapter.dump_json([TicketPurchasePublic.model_validate(p) for p in purchases])
+    return Response(content=body, media_type="application/json")
+
+
+# E) Organizer dashboard: types + purchases + sold count per type, in one call
+@router.get("/{event_id}/tickets/overview", response_model=None, responses={200: {"model": TicketOverviewPublic}})
+def tickets_overview(
+    event_id: int,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    # droits vérifiés une seule fois pour les deux listes (depuis le cache si possible)
+    ctx = _load_event_ctx(db, event_id, current_user.id)
+    _ensure_public_event(ctx)
+    _ensure_organizer(ctx)
+
+    types = db.execute(
+        select(TicketType).options(raiseload("*")).where(TicketType.event_id == event_id)
+    ).scalars().all()
+    purchases = db.execute(
+        select(TicketPurchase)
+        .options(raiseload("*"))
+        .where(TicketPurchase.event_id == event_id)
+        .order_by(TicketPurchase.id)
+    ).scalars().all()
+
+    # ventes par type : compteur dénormalisé sold_count, sans GROUP BY sur les achats
+    overview = TicketOverviewPublic.model_construct(
+        types=[TicketTypePublic.model_validate(t) for t in types],
+        purchases=[TicketPurchasePublic.model_validate(p) for p in purchases],
+        sold_by_type={t.id: t.sold_count for t in types},
+    )
+    return Response(overview.model_dump_json(), media_type="application/json")
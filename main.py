@@ -1,39 +1,36 @@
-from fastapi import FastAPI
-from app.db import Base, engine
-from app import models  
-from app.auth_routes import router as auth_router
+from contextlib import asynccontextmanager
+from importlib import import_module
 
-app = FastAPI(title="My Social Networks API")
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
-Base.metadata.create_all(bind=engine)
+# Routeurs, dans l'ordre d'inclusion
+ROUTERS = ("auth", "group", "event", "discussion", "album", "poll", "ticket", "shopping")
 
-app.include_router(auth_router)
 
-@app.get("/")
-def root():
-    return {"message": "My Social Networks API is running"}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # pas de DDL ici : le schéma est créé au déploiement (python -m app.init_db),
+    # une seule fois, et non par chaque worker au démarrage
+    yield
 
-@app.get("/health")
-def health():
-    return {"status": "ok"}
 
-from app.group_routes import router as group_router
-app.include_router(group_router)
+def create_app() -> FastAPI:
+    # réponses encodées par orjson (C, datetimes natifs) plutôt que json de la stdlib
+    app = FastAPI(title="My Social Networks API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
-from app.event_routes import router as event_router
-app.include_router(event_router)
+    for name in ROUTERS:
+        app.include_router(import_module(f"app.{name}_routes").router)
 
-from app.discussion_routes import router as discussion_router
-app.include_router(discussion_router)
+    @app.get("/")
+    def root():
+        return {"message": "My Social Networks API is running"}
 
-from app.album_routes import router as album_router
-app.include_router(album_router)
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
 
-from app.poll_routes import router as poll_router
-app.include_router(poll_router)
+    return app
 
-from app.ticket_routes import router as ticket_router
-app.include_router(ticket_router)
 
-from app.shopping_routes import router as shopping_router
-app.include_router(shopping_router)
+app = create_app()